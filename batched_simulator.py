@@ -0,0 +1,364 @@
+"""
+A NumPy engine that advances many independent pirate games in lockstep.
+It mirrors the rules of simulator.Simulator (sail, collect, deposit, plunder and wait actions, the marines random walk,
+treasure arrivals and collision penalties), holding every game of the batch as rows of NumPy arrays.
+It is meant for rollouts: BatchedSimulator.rollout() plays all the games to the end with uniformly random legal actions.
+"""
+
+import random
+
+import numpy as np
+
+from game_state import GameState
+from simulator import Simulator, TREASURE_ARRIVAL_PROBABILITY, TREASURE_NAMES
+
+# Kinds of atomic actions, as encoded in the action arrays.
+WAIT, SAIL, COLLECT, DEPOSIT, PLUNDER = range(5)
+# The order of the neighbors in the sail candidates (same as in Simulator.neighbors()).
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+# Static layouts, keyed by everything in a game that never changes.
+_LAYOUTS = {}
+
+
+class BatchLayout:
+    """
+    The static part of a game, as arrays: map, base, ships, marine paths and the treasure slots.
+    Every treasure name gets a fixed slot, the names a treasure can arrive with come first.
+    """
+    def __init__(self, game_state, extra_treasure_names):
+        self.map = game_state.map
+        self.rows, self.columns = len(game_state.map), len(game_state.map[0])
+        self.islands = np.array([[cell == 'I' for cell in row] for row in game_state.map])
+        self.island_cells = np.argwhere(self.islands)
+        self.base = np.array(game_state.base)
+        self.ship_names = game_state.ship_names
+        self.ship_players = np.array(game_state.ship_players)
+        self.marine_names = game_state.marine_names
+        self.marine_lengths = np.array([len(path) for path in game_state.marine_paths], dtype=np.int64)
+        longest = max(self.marine_lengths, default=1)
+        self.marine_paths = np.zeros((len(game_state.marine_paths), longest, 2), dtype=np.int64)
+        for marine, path in enumerate(game_state.marine_paths):
+            self.marine_paths[marine, :len(path)] = path
+        self.treasure_names = tuple(TREASURE_NAMES) + tuple(extra_treasure_names)
+        self.treasure_slot = {name: slot for slot, name in enumerate(self.treasure_names)}
+        self.arrival_slots = len(TREASURE_NAMES)
+        # The sea neighbors of every cell, by cell number (row * columns + column), -1 where there is none.
+        self.neighbor_table = np.full((self.rows * self.columns, len(DIRECTIONS)), -1, dtype=np.int64)
+        for x in range(self.rows):
+            for y in range(self.columns):
+                for direction, (d_x, d_y) in enumerate(DIRECTIONS):
+                    n_x, n_y = x + d_x, y + d_y
+                    if 0 <= n_x < self.rows and 0 <= n_y < self.columns and not self.islands[n_x, n_y]:
+                        self.neighbor_table[x * self.columns + y, direction] = n_x * self.columns + n_y
+
+    @classmethod
+    def of(cls, game_state):
+        """ Returns the (cached) layout of the game the given state belongs to. """
+        extra_treasure_names = tuple(sorted(name for name in game_state.treasures if name not in TREASURE_NAMES))
+        key = (game_state.map, game_state.base, game_state.ship_names, game_state.ship_players,
+               game_state.marine_names, game_state.marine_paths, extra_treasure_names)
+        layout = _LAYOUTS.get(key)
+        if layout is None:
+            layout = _LAYOUTS[key] = cls(game_state, extra_treasure_names)
+        return layout
+
+
+class BatchedSimulator:
+    """
+    batch_size independent copies of a game, advanced together.
+    Ships are addressed by index, treasures by their slot in the layout;
+    a treasure holder of -1 means the treasure lies on the map.
+    """
+    def __init__(self, initial_state, batch_size, rng=None, score=None):
+        game_state = initial_state if isinstance(initial_state, GameState) else GameState.from_dict(initial_state)
+        self.layout = layout = BatchLayout.of(game_state)
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(rng)
+        self.MARINE_COLLISION_PENALTY = 1
+        self.turns_to_go = game_state.turns_to_go
+
+        n, ships, slots = batch_size, len(layout.ship_names), len(layout.treasure_names)
+        self.ship_locations = np.repeat(np.array(game_state.ship_locations, dtype=np.int64).reshape(1, ships, 2), n, 0)
+        self.ship_capacities = np.repeat(np.array([game_state.ship_capacities], dtype=np.int64), n, 0)
+        self.treasure_present = np.zeros((n, slots), dtype=bool)
+        self.treasure_cells = np.zeros((n, slots, 2), dtype=np.int64)
+        self.treasure_holders = np.full((n, slots), -1, dtype=np.int64)
+        self.treasure_rewards = np.zeros((n, slots), dtype=np.int64)
+        for name, (location, reward) in game_state.treasures.items():
+            slot = layout.treasure_slot[name]
+            self.treasure_present[:, slot] = True
+            self.treasure_rewards[:, slot] = reward
+            if type(location) == str:
+                self.treasure_holders[:, slot] = game_state.ship_index[location]
+            else:
+                self.treasure_cells[:, slot] = location
+        self.marine_indices = np.repeat(np.array([game_state.marine_indices], dtype=np.int64).reshape(1, -1), n, 0)
+        score = score or {'player 1': 0, 'player 2': 0}
+        self.scores = np.repeat(np.array([[score['player 1'], score['player 2']]], dtype=np.int64), n, 0)
+
+    @classmethod
+    def from_simulator(cls, simulator, batch_size, rng=None):
+        """ batch_size copies of the current game of a scalar Simulator, including its score. """
+        return cls(simulator.game_state, batch_size, rng, simulator.score)
+
+    # ------------------------------------------------------------------
+    # Actions
+
+    def random_actions(self, player):
+        """
+        Draws a uniformly random legal atomic action for every ship of the player, in every game.
+        As in the agents, the collect action of a treasure is offered only to the first of the player's ships that
+        can collect it, so the joint actions are never mutex.
+        Returns (kinds, targets) arrays of shape (batch_size, ships), for the ships of the player only;
+        the target is a cell number for sail, a treasure slot for collect / deposit and a ship index for plunder.
+        """
+        layout = self.layout
+        n, ships, slots = self.batch_size, len(layout.ship_names), len(layout.treasure_names)
+        rows = np.arange(n)
+        my_ships = np.flatnonzero(layout.ship_players == player)
+        on_map = self.treasure_present & (self.treasure_holders == -1)
+        offered = np.zeros((n, slots), dtype=bool)
+        kinds = np.zeros((n, len(my_ships)), dtype=np.int64)
+        targets = np.zeros((n, len(my_ships)), dtype=np.int64)
+        for k, ship in enumerate(my_ships):
+            location = self.ship_locations[:, ship]
+            cells = location[:, 0] * layout.columns + location[:, 1]
+            sail_targets = layout.neighbor_table[cells]
+            distance = np.abs(self.treasure_cells - location[:, None, :]).sum(2)
+            collect = on_map & (distance == 1) & (self.ship_capacities[:, ship] > 0)[:, None] & ~offered
+            offered |= collect
+            at_base = (location == layout.base).all(1)
+            deposit = self.treasure_present & (self.treasure_holders == ship) & at_base[:, None]
+            plunder = ((self.ship_locations == location[:, None, :]).all(2)
+                       & (layout.ship_players != player)[None, :])
+            legal = np.concatenate([sail_targets >= 0, collect, deposit, plunder, np.ones((n, 1), dtype=bool)], 1)
+            keys = self.rng.random(legal.shape)
+            keys[~legal] = -1
+            choice = keys.argmax(1)
+
+            sail_end, collect_end, deposit_end = len(DIRECTIONS), len(DIRECTIONS) + slots, len(DIRECTIONS) + 2 * slots
+            plunder_end = deposit_end + ships
+            kinds[:, k] = np.select([choice < sail_end, choice < collect_end, choice < deposit_end, choice < plunder_end],
+                                    [SAIL, COLLECT, DEPOSIT, PLUNDER], WAIT)
+            targets[:, k] = np.select(
+                [choice < sail_end, choice < collect_end, choice < deposit_end, choice < plunder_end],
+                [sail_targets[rows, np.minimum(choice, sail_end - 1)], choice - sail_end, choice - collect_end,
+                 choice - deposit_end], 0)
+        return kinds, targets
+
+    def encode_actions(self, actions, player):
+        """ Converts one joint action (in the Simulator format) per game into (kinds, targets) arrays. """
+        layout = self.layout
+        ship_index = {name: i for i, name in enumerate(layout.ship_names)}
+        my_ships = [name for name, owner in zip(layout.ship_names, layout.ship_players) if owner == player]
+        kinds = np.zeros((self.batch_size, len(my_ships)), dtype=np.int64)
+        targets = np.zeros((self.batch_size, len(my_ships)), dtype=np.int64)
+        for game, action in enumerate(actions):
+            for atomic_action in action:
+                k = my_ships.index(atomic_action[1])
+                if atomic_action[0] == 'sail':
+                    kinds[game, k] = SAIL
+                    targets[game, k] = atomic_action[2][0] * layout.columns + atomic_action[2][1]
+                elif atomic_action[0] == 'collect':
+                    kinds[game, k], targets[game, k] = COLLECT, layout.treasure_slot[atomic_action[2]]
+                elif atomic_action[0] == 'deposit':
+                    kinds[game, k], targets[game, k] = DEPOSIT, layout.treasure_slot[atomic_action[2]]
+                elif atomic_action[0] == 'plunder':
+                    kinds[game, k], targets[game, k] = PLUNDER, ship_index[atomic_action[2]]
+        return kinds, targets
+
+    def decode_action(self, kinds, targets, game, player):
+        """ The joint action of one game, in the Simulator format. """
+        layout = self.layout
+        my_ships = [name for name, owner in zip(layout.ship_names, layout.ship_players) if owner == player]
+        action = []
+        for k, ship_name in enumerate(my_ships):
+            kind, target = kinds[game, k], int(targets[game, k])
+            if kind == SAIL:
+                action.append(('sail', ship_name, divmod(target, layout.columns)))
+            elif kind == COLLECT:
+                action.append(('collect', ship_name, layout.treasure_names[target]))
+            elif kind == DEPOSIT:
+                action.append(('deposit', ship_name, layout.treasure_names[target]))
+            elif kind == PLUNDER:
+                action.append(('plunder', ship_name, layout.ship_names[target]))
+            else:
+                action.append(('wait', ship_name))
+        return tuple(action)
+
+    def apply_actions(self, kinds, targets, player):
+        """
+        Applies an encoded joint action of the player in every game (Simulator.apply_action()).
+        The actions must be legal, they are not checked.
+        """
+        layout = self.layout
+        for k, ship in enumerate(np.flatnonzero(layout.ship_players == player)):
+            kind, target = kinds[:, k], targets[:, k]
+            games = np.flatnonzero(kind == SAIL)
+            self.ship_locations[games, ship, 0], self.ship_locations[games, ship, 1] = divmod(target[games], layout.columns)
+            games = np.flatnonzero(kind == COLLECT)
+            self.ship_capacities[games, ship] -= 1
+            self.treasure_holders[games, target[games]] = ship
+            games = np.flatnonzero(kind == DEPOSIT)
+            self.ship_capacities[games, ship] += 1
+            self.scores[games, player - 1] += self.treasure_rewards[games, target[games]]
+            self.treasure_present[games, target[games]] = False
+            games = np.flatnonzero(kind == PLUNDER)
+            self.ship_capacities[games, target[games]] = 2
+            self.treasure_present[games] &= self.treasure_holders[games] != target[games, None]
+        self.turns_to_go -= 1
+
+    def act(self, actions, player):
+        """ Simulator.act() without the legality check, actions holds one joint action per game. """
+        self.apply_actions(*self.encode_actions(actions, player), player)
+        self.add_treasure()
+
+    # ------------------------------------------------------------------
+    # Random events
+
+    def add_treasure(self):
+        """ Simulator.add_treasure() in every game. """
+        layout = self.layout
+        arriving = np.flatnonzero((self.treasure_present.sum(1) <= 9)
+                                  & (self.rng.random(self.batch_size) < TREASURE_ARRIVAL_PROBABILITY))
+        if len(arriving) == 0 or len(layout.island_cells) == 0:
+            return
+        # A uniform choice among the names that are not in the game yet.
+        keys = self.rng.random((len(arriving), layout.arrival_slots))
+        absent = ~self.treasure_present[arriving, :layout.arrival_slots]
+        keys[~absent] = -1
+        arriving, slots = arriving[absent.any(1)], keys[absent.any(1)].argmax(1)
+        cells = layout.island_cells[self.rng.integers(0, len(layout.island_cells), len(arriving))]
+        self.treasure_present[arriving, slots] = True
+        self.treasure_cells[arriving, slots] = cells
+        self.treasure_holders[arriving, slots] = -1
+        self.treasure_rewards[arriving, slots] = self.rng.integers(1, 10, len(arriving))
+
+    def marine_locations(self):
+        """ The current cell of every marine, shape (batch_size, marines, 2). """
+        marines = np.arange(len(self.layout.marine_names))
+        return self.layout.marine_paths[marines[None, :], self.marine_indices]
+
+    def check_collision_with_marines(self):
+        """ Simulator.check_collision_with_marines() in every game. """
+        marine_locations = self.marine_locations()
+        for ship, player in enumerate(self.layout.ship_players):
+            hit = (self.ship_locations[:, None, ship] == marine_locations).all(2).any(1)
+            games = np.flatnonzero(hit)
+            self.ship_capacities[games, ship] = 2
+            self.scores[games, player - 1] -= self.MARINE_COLLISION_PENALTY
+            self.treasure_present[games] &= self.treasure_holders[games] != ship
+
+    def move_marines(self):
+        """ Simulator.move_marines() in every game: a uniform step to the same or an adjacent index of the path. """
+        lengths = self.layout.marine_lengths[None, :]
+        index = self.marine_indices
+        draws = self.rng.random(index.shape)
+        at_end = (index == 0) | (index == lengths - 1)
+        step = np.where(at_end, (draws * 2).astype(np.int64), (draws * 3).astype(np.int64) - 1)
+        step = np.where(index == lengths - 1, -step, step)
+        self.marine_indices = np.where(lengths > 1, index + step, index)
+
+    # ------------------------------------------------------------------
+    # Rollouts
+
+    def rollout(self, player):
+        """
+        Plays every game to the end with uniformly random legal actions, starting with the given player.
+        Rounds end after player 2 acts, with the marine collisions and moves, as in main.Game.
+        Returns the final scores, shape (batch_size, 2).
+        """
+        while self.turns_to_go > 0:
+            self.apply_actions(*self.random_actions(player), player)
+            self.add_treasure()
+            if player == 2:
+                self.check_collision_with_marines()
+                self.move_marines()
+            player = 3 - player
+        return self.scores
+
+    def game_state(self, game):
+        """ The state of one game of the batch, in the dict format. """
+        layout = self.layout
+        treasures = {}
+        for slot in np.flatnonzero(self.treasure_present[game]):
+            holder = self.treasure_holders[game, slot]
+            location = layout.ship_names[holder] if holder >= 0 else tuple(int(c) for c in self.treasure_cells[game, slot])
+            treasures[layout.treasure_names[slot]] = {'location': location,
+                                                      'reward': int(self.treasure_rewards[game, slot])}
+        return {
+            'map': [list(row) for row in layout.map],
+            'base': tuple(int(c) for c in layout.base),
+            'pirate_ships': {name: {'location': tuple(int(c) for c in self.ship_locations[game, ship]),
+                                    'capacity': int(self.ship_capacities[game, ship]),
+                                    'player': int(layout.ship_players[ship])}
+                             for ship, name in enumerate(layout.ship_names)},
+            'treasures': treasures,
+            'marine_ships': {name: {'index': int(self.marine_indices[game, marine]),
+                                    'path': [tuple(int(c) for c in cell)
+                                             for cell in layout.marine_paths[marine, :layout.marine_lengths[marine]]]}
+                             for marine, name in enumerate(layout.marine_names)},
+            'turns to go': self.turns_to_go
+        }
+
+    def score(self, game):
+        """ The score of one game of the batch, in the Simulator format. """
+        return {'player 1': int(self.scores[game, 0]), 'player 2': int(self.scores[game, 1])}
+
+
+def check_parity(initial_state, rounds=50, batch_size=16, seed=0):
+    """
+    Checks BatchedSimulator against the scalar Simulator, along a game of random legal actions.
+    Every step, a batch is loaded from the scalar simulator and:
+        - the joint action drawn in every game of the batch must be legal for the scalar simulator,
+        - applying it must give the same state and score in both engines,
+        - treasure arrivals and marine moves must only produce outcomes the scalar rules allow,
+        - collisions with marines must give the same state and score in both engines.
+    Raises AssertionError on the first mismatch, otherwise returns the number of checked transitions.
+    """
+    random_generator = random.Random(seed)
+    simulator = Simulator(initial_state, random_generator.getrandbits(64))
+    checked = 0
+
+    def same(batch, game, scalar):
+        return batch.game_state(game) == scalar.get_state() and batch.score(game) == scalar.get_score()
+
+    for _ in range(rounds):
+        if simulator.turns_to_go <= 0:
+            break
+        for player in (1, 2):
+            batch = BatchedSimulator.from_simulator(simulator, batch_size, random_generator.getrandbits(32))
+            kinds, targets = batch.random_actions(player)
+            actions = [batch.decode_action(kinds, targets, game, player) for game in range(batch_size)]
+            batch.apply_actions(kinds, targets, player)
+            for game, action in enumerate(actions):
+                assert simulator.check_if_action_legal(action, player), f"illegal batched action {action}"
+                expected = simulator.clone()
+                expected.apply_action(action, player)
+                assert same(batch, game, expected), f"apply_action mismatch for {action}"
+                checked += 1
+            before = [batch.game_state(game)['treasures'] for game in range(batch_size)]
+            batch.add_treasure()
+            for game in range(batch_size):
+                new = {name: treasure for name, treasure in batch.game_state(game)['treasures'].items()
+                       if name not in before[game]}
+                assert len(new) <= 1 and len(before[game]) + len(new) <= 10
+                for name, treasure in new.items():
+                    row, column = treasure['location']
+                    assert name in TREASURE_NAMES and batch.layout.islands[row, column]
+                    assert 1 <= treasure['reward'] <= 9
+            simulator.act(actions[0], player)
+
+        batch = BatchedSimulator.from_simulator(simulator, batch_size, random_generator.getrandbits(32))
+        batch.check_collision_with_marines()
+        simulator.check_collision_with_marines()
+        assert all(same(batch, game, simulator) for game in range(batch_size)), "collision mismatch"
+        batch.move_marines()
+        for game in range(batch_size):
+            for marine, path in enumerate(simulator.game_state.marine_paths):
+                before, after = simulator.game_state.marine_indices[marine], int(batch.marine_indices[game, marine])
+                assert 0 <= after < len(path) and abs(after - before) <= 1, f"illegal marine move {before} -> {after}"
+        simulator.move_marines()
+        checked += batch_size
+    return checked
@@ -0,0 +1,98 @@
+"""
+Compares the tree-parallel search of UCTAgent against the serial search:
+    - throughput: MCTS iterations per second and tree nodes grown, searching the initial state of main.py.
+    - move quality: the score difference against the sample agent in short games, played as in main.py.
+Run with python benchmark.py [--threads 1 2 4] [--time 1.0] [--games 2] [--rounds 10] > bench_output.txt
+"""
+
+import argparse
+import logging
+from time import time
+
+from simulator import Simulator
+import exp3_322720103_314779166
+import sample_agent
+
+
+# The game of main.py.
+INITIAL_STATE = {
+    "map": [
+        ['S', 'S', 'I', 'S', 'S', 'S', 'S'],
+        ['S', 'S', 'I', 'S', 'S', 'S', 'S'],
+        ['B', 'S', 'S', 'S', 'S', 'S', 'S'],
+        ['S', 'S', 'I', 'S', 'S', 'I', 'S'],
+        ['S', 'S', 'I', 'S', 'S', 'I', 'S'],
+        ['S', 'S', 'S', 'S', 'S', 'I', 'S'],
+        ['S', 'S', 'S', 'S', 'S', 'I', 'I']
+    ],
+    "base": (2, 0),
+    "pirate_ships": {'pirate_ship_1': {"location": (2, 0), "capacity": 2, "player": 1},
+                     'pirate_ship_2': {"location": (2, 0), "capacity": 2, "player": 1},
+                     'pirate_ship_3': {"location": (2, 0), "capacity": 2, "player": 2},
+                     'pirate_ship_4': {"location": (2, 0), "capacity": 2, "player": 2}},
+    "treasures": {'treasure_1': {"location": (0, 2), "reward": 4}},
+    "marine_ships": {'marine_1': {"index": 0, "path": [(0, 1), (1, 1), (2, 1), (2, 2), (2, 3), (2, 4)]},
+                     'marine_2': {"index": 0, "path": [(2, 5), (2, 4), (3, 4), (4, 4)]}},
+    "turns to go": 200
+}
+
+
+def tree_size(root):
+    size = 0
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        size += 1
+        nodes.extend(node.children)
+    return size
+
+
+def throughput(threads, time_limit, searches):
+    """ Returns the iterations per second and the tree nodes per search of the initial state. """
+    agent = exp3_322720103_314779166.UCTAgent(INITIAL_STATE, 1, seed=0, threads=threads)
+    iterations = nodes = 0
+    for _ in range(searches):
+        root, _ = agent.search(INITIAL_STATE, time(), time_limit)
+        iterations += root.visits
+        nodes += tree_size(root)
+    agent.close()
+    return iterations / (time_limit * searches), nodes / searches
+
+
+def play(threads, time_limit, player_number, seed, rounds):
+    """ Plays rounds rounds against the sample agent and returns our score minus the rival's. """
+    simulator = Simulator(INITIAL_STATE, seed)
+    agent = exp3_322720103_314779166.UCTAgent(INITIAL_STATE, player_number, seed=seed, threads=threads,
+                                              action_timeout=time_limit)
+    agents = {player_number: agent, 3 - player_number: sample_agent.Agent(INITIAL_STATE, 3 - player_number, seed)}
+    for _ in range(rounds):
+        for player in (1, 2):
+            simulator.act(agents[player].act(simulator.get_state()), player)
+        simulator.check_collision_with_marines()
+        simulator.move_marines()
+    agent.close()
+    score = simulator.get_score()
+    return score[f'player {player_number}'] - score[f'player {3 - player_number}']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--time', type=float, default=1.0,
+                        help='search time of the throughput searches and action timeout of the games, in seconds')
+    parser.add_argument('--searches', type=int, default=3)
+    parser.add_argument('--games', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"threads":>8} {"iterations/s":>13} {"tree nodes":>11} {"score diff":>11}')
+    for threads in args.threads:
+        iterations_per_second, nodes = throughput(threads, args.time, args.searches)
+        differences = [play(threads, args.time, 1 + game % 2, game, args.rounds) for game in range(args.games)]
+        print(f'{threads:>8} {iterations_per_second:>13.1f} {nodes:>11.1f} '
+              f'{sum(differences) / max(len(differences), 1):>11.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+A fast heuristic evaluation of a game state, for rollouts cut before the end of the game.
+It is built from the signals the greedy Agent uses: the banked score, the treasures the ships carry,
+the distance of a ship to the base (sailing as Agent.choose_sail_action does) and the marines' risk.
+"""
+
+from marine_forecast import MarineForecast
+
+
+class LeafEvaluator:
+    """
+    Estimates the final score of each player as their banked score plus the expected value of the treasures their
+    ships carry: a carried treasure counts by the probability that its ship brings it to the base, that is, that
+    the base can be reached in the turns left without meeting a marine on the way.
+    The way of a ship from every cell to the base is computed once and cached.
+    """
+    def __init__(self, marine_forecast):
+        self.marine_forecast = marine_forecast
+        # routes[location] - the cells a ship sails through from the location to the base (ending in the base),
+        # or None if it doesn't get there.
+        self.routes = {}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(MarineForecast.from_state(state))
+
+    def route(self, simulator, location):
+        """ The cells of the greedy way from the location to the base: every step goes to the closest neighbor. """
+        route = self.routes.get(location, False)
+        if route is not False:
+            return route
+        base = simulator.base_location
+        rows, columns = simulator.dimensions
+        route = []
+        cell = location
+        while cell != base and len(route) < rows * columns:
+            neighbors = simulator.neighbors(cell)
+            if not neighbors:
+                break
+            cell = min(neighbors, key=lambda neighbor: abs(neighbor[0] - base[0]) + abs(neighbor[1] - base[1]))
+            route.append(cell)
+        route = self.routes[location] = tuple(route) if cell == base else None
+        return route
+
+    def delivery_probability(self, simulator, location):
+        """ The probability that a ship at the location deposits its treasures before the game ends. """
+        route = self.route(simulator, location)
+        # A ship sails once a round, and deposits in the round after it reaches the base.
+        if route is None or len(route) + 1 > simulator.turns_to_go // 2:
+            return 0.0
+        marine_indices = simulator.game_state.marine_indices
+        probability = 1.0
+        for turns, cell in enumerate(route):
+            probability *= 1 - self.marine_forecast.risk(cell, marine_indices, turns)
+        return probability
+
+    def evaluate(self, simulator):
+        """ Returns the estimated final scores, as a dict in the format of Simulator.get_score(). """
+        game_state = simulator.game_state
+        scores = dict(simulator.get_score())
+        for name, (location, reward) in game_state.treasures.items():
+            if type(location) != str:
+                continue
+            ship = game_state.ship_index[location]
+            player_key = f"player {game_state.ship_players[ship]}"
+            scores[player_key] += reward * self.delivery_probability(simulator, game_state.ship_locations[ship])
+        return scores
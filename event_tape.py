@@ -0,0 +1,48 @@
+"""
+Pre-drawn random events for determinized, replayable rollouts.
+All the randomness of an episode comes from treasure arrivals (Simulator.add_treasure(), once per act())
+and marine moves (Simulator.move_marines(), once per round). An EventTape holds the whole future of those draws
+in compact arrays, and a Simulator with a tape attached consumes it instead of its random generator.
+"""
+
+from array import array
+
+
+class EventTape:
+    """
+    The random draws of an episode:
+        - per act(): the arrival draw, the name draw, the cell draw (uniform fractions) and the reward (1 to 9).
+        - per move_marines(), per marine: a uniform fraction choosing among the marine's possible next indices.
+    The draws are fractions that are mapped onto the choices available when they are consumed
+    (e.g. the k-th name that is not in the game yet), so the same tape fits every state of the game.
+    A tape is never changed by the simulators using it, so any number of them can share it.
+    """
+    def __init__(self, acts, rounds, marines, rng):
+        self.acts = acts
+        self.rounds = rounds
+        self.marines = marines
+        self.arrival_draws = array('d', [rng.random() for _ in range(acts)])
+        self.name_draws = array('d', [rng.random() for _ in range(acts)])
+        self.cell_draws = array('d', [rng.random() for _ in range(acts)])
+        self.rewards = array('B', [rng.randint(1, 9) for _ in range(acts)])
+        self.marine_draws = array('d', [rng.random() for _ in range(rounds * marines)])
+
+    @classmethod
+    def for_simulator(cls, simulator, rng=None):
+        """
+        Draws a tape long enough for the rest of the simulator's game, from rng (or the simulator's generator).
+        """
+        turns_to_go = simulator.turns_to_go
+        return cls(turns_to_go, turns_to_go // 2 + 1, len(simulator.game_state.marine_names), rng or simulator.rng)
+
+    def treasure_draws(self, act):
+        """ Returns the (arrival, name, cell, reward) draws of the given act() call, or None past the end of the tape. """
+        if act >= self.acts:
+            return None
+        return self.arrival_draws[act], self.name_draws[act], self.cell_draws[act], self.rewards[act]
+
+    def marine_draw(self, move, marine):
+        """ Returns the draw of a marine in the given move_marines() call, or None past the end of the tape. """
+        if move >= self.rounds:
+            return None
+        return self.marine_draws[move * self.marines + marine]
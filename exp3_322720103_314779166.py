@@ -1,11 +1,23 @@
 IDS = ["322720103", "314779166"]
 from simulator import Simulator
+from marine_forecast import MarineForecast
+from rollout import RolloutEngine, uniform_policy, GreedyPolicy, EpsilonGreedyPolicy
+from time_manager import TimeManager
+from transposition_table import TranspositionTable
+from evaluation import LeafEvaluator
+from tree_store import TreeStore
+from event_tape import EventTape
+from opening_book import OpeningBook
 import random
 import math
 from sample_agent import Agent 
-from itertools import product
 from copy import deepcopy
-from time import time
+from time import time, sleep
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+import multiprocessing
+import atexit
+import os
 
 
 
@@ -16,6 +28,10 @@ class Agent:
         self.my_ships = []
         self.rival_ships = list()
         self.simulator = Simulator(initial_state)
+        self.marine_forecast = MarineForecast.from_state(initial_state)
+        # The map doesn't change, so the best step from a cell towards the base or a treasure is computed once.
+        self.steps_to_base = {}
+        self.steps_to_treasure = {}
         # Saving the ships of the player and the rival player.
         for ship_name, ship in initial_state['pirate_ships'].items():
             if ship['player'] == player_number:
@@ -25,62 +41,44 @@ class Agent:
 
 
     def act(self, state):
-        collected_treasures = []
+        # The simulator is set to the state, so the candidate actions of every ship are its legal atomic actions.
+        self.simulator.set_state(state)
         whole_action = list()  # A list that holds the action we choose for each of our pirate ships.
-
-        for ship in self.my_ships:  # For each pirate ship of our player, we will choose an action.
-            found_action = False
-
-            # If the ship is in the base and has treasures, we will deposit them.
-            for treasure in state["treasures"].keys():
-                if (state["pirate_ships"][ship]["location"] == state["base"]
-                        and state["treasures"][treasure]["location"] == ship):
-                    whole_action.append(("deposit", ship, treasure))
-                    found_action = True
-                    break
-            if found_action:
-                continue
-
-            # If the ship is adjacent to a treasure, we will collect it.
-            if state["pirate_ships"][ship]["capacity"] > 0:
-                for treasure in state["treasures"].keys():
-                    if state["pirate_ships"][ship]["location"] in self.simulator.neighbors(
-                            state["treasures"][treasure]["location"]) and treasure not in collected_treasures:
-                        whole_action.append(("collect", ship, treasure))
-                        collected_treasures.append(treasure)
-                        found_action = True
-                        break
-            if found_action:
-                continue
-            
-            # If the ship is in the same location as an enemy ship, we will plunder it.
-            for enemy_ship_name in self.rival_ships:
-                if (state["pirate_ships"][ship]["location"] == state["pirate_ships"][enemy_ship_name]["location"] and
-                        self.player_number != state["pirate_ships"][enemy_ship_name]["player"]):
-                    if state["pirate_ships"][enemy_ship_name]["capacity"] < 2:
-                        whole_action.append(("plunder", ship, enemy_ship_name))
-                        found_action = True
-                        break
-            if found_action:
-                continue
-
-            # If we didn't choose any of our "favourite" actions above,
-            # we move on to check other actions this pirate ship can make - 'sail' or 'wait'.
-            whole_action.append(self.choose_sail_action(ship, state))
+        # The collect action of a treasure is offered only to the first ship that can collect it.
+        for ship, atomic_actions in self.simulator.legal_actions_by_ship(self.player_number).items():
+            action = self.preferred_action(atomic_actions, self.simulator.game_state)
+            if action is None:
+                # If we didn't choose any of our "favourite" actions,
+                # we move on to check other actions this pirate ship can make - 'sail' or 'wait'.
+                action = self.choose_sail_action(ship, state)
+            whole_action.append(action)
         return tuple(whole_action)  # Returning the chosen actions for all of our pirate ships in a tuple format.
 
+    @staticmethod
+    def preferred_action(atomic_actions, game_state):
+        """ Returns the "favourite" action among the legal atomic actions of a ship, or None if it has none:
+            deposit the treasures it holds (in the base), then collect an adjacent treasure,
+            then plunder a rival ship (on the same cell) that holds treasures.
+        """
+        for kind in ('deposit', 'collect', 'plunder'):
+            for atomic_action in atomic_actions:
+                if atomic_action[0] != kind:
+                    continue
+                if kind == 'plunder' and game_state.ship_capacities[game_state.ship_index[atomic_action[2]]] == 2:
+                    continue
+                return atomic_action
+        return None
 
-    def marine_location(self, state):
-        """ Returns a list of the current locations of the marine ships. """
-        marine_locations = []
-        for marine_stats in state["marine_ships"].values():
-            index = marine_stats["index"]
-            marine_locations.append(marine_stats["path"][index])
-        return marine_locations
 
-    def collision_with_marine(self, location, marine_locations):
-        """ Returns True if the location we want to sail to currently has a marine ship, otherwise False. """
-        if location in marine_locations:
+    def marine_risk(self, state, turns=0):
+        """ Returns a dict from a cell to the probability of meeting a marine ship there after turns marine moves.
+            Collisions are checked before the marines move, so turns=0 is the risk of the cell we sail to now.
+        """
+        return self.marine_forecast.risk_map(self.marine_forecast.indices(state), turns)
+
+    def collision_with_marine(self, location, marine_risk):
+        """ Returns True if the location we want to sail to may have a marine ship, otherwise False. """
+        if marine_risk.get(location, 0) > 0:
             return True
         else:
             return False
@@ -91,25 +89,34 @@ class Agent:
             the reward we can get from each treasure,
             and the locations of the marine ships.
         """
+        sail_to = self.sail_target(pirate_ship, state)
+        # If the location we want to sail to has a marine ship, we will wait.
+        if self.collision_with_marine(sail_to, self.marine_risk(state)):
+            return ('wait', pirate_ship)
+        return ('sail', pirate_ship, sail_to)
+
+    def sail_target(self, pirate_ship, state):
+        """ Returns the cell a specific pirate ship wants to sail to, regardless of the marine ships:
+            towards the base if it holds treasures, otherwise towards the treasure with the best reward per distance.
+        """
         my_capacity = state["pirate_ships"][pirate_ship]["capacity"] # if 2, my two hands are empty
         # Initialized with infinity values (so that the distance of an unreachable treasure will be infinity) and updated with the actual distances.
         min_distances_to_treasure, min_distances_to_base = float('inf'), float('inf')
         base_location = state["base"]
         pirate_location = state["pirate_ships"][pirate_ship]["location"]
-        marine_locations = self.marine_location(state)
         
         # If the pirate ship holds treasures, we will sail to the base to deposit them.
         if my_capacity < 2:
-            # Find the direction closest to the base as the direction we want to sail to.
-            for neighbor in self.simulator.neighbors(pirate_location):
-                temp_dist_to_base = abs(neighbor[0]-base_location[0]) + abs(neighbor[1]-base_location[1])
-                if temp_dist_to_base < min_distances_to_base:
-                    min_distances_to_base = temp_dist_to_base
-                    min_dist_to_base_neighbor = neighbor
-            # If the location we want to sail to has a marine ship, we will wait.
-            if self.collision_with_marine(min_dist_to_base_neighbor, marine_locations):
-                return ('wait', pirate_ship)
-            return ('sail', pirate_ship, min_dist_to_base_neighbor)
+            min_dist_to_base_neighbor = self.steps_to_base.get(pirate_location)
+            if min_dist_to_base_neighbor is None:
+                # Find the direction closest to the base as the direction we want to sail to.
+                for neighbor in self.simulator.neighbors(pirate_location):
+                    temp_dist_to_base = abs(neighbor[0]-base_location[0]) + abs(neighbor[1]-base_location[1])
+                    if temp_dist_to_base < min_distances_to_base:
+                        min_distances_to_base = temp_dist_to_base
+                        min_dist_to_base_neighbor = neighbor
+                self.steps_to_base[pirate_location] = min_dist_to_base_neighbor
+            return min_dist_to_base_neighbor
         
         available_treasures = [v for v in state["treasures"].values() if type(v['location']) == tuple]
         scores = [(0,)] * len(available_treasures)  # A list that holds a tuple of the score we calculated for each treasure and the location we want to sail to in order to reach it.
@@ -117,24 +124,25 @@ class Agent:
         for t, t_info in enumerate(available_treasures):
             treasure_location = t_info["location"]
             treasure_reward = t_info["reward"]
-            # For each adjacent cell of the treasure (from which we can collect this treasure), we will calculate the distance from the pirate ship to it.
-            for adjacent in self.simulator.neighbors(treasure_location):
-                # Find the direction closest to the treasure as the direction we want to sail to.
-                for neighbor in self.simulator.neighbors(pirate_location):
-                    temp_dist_to_treasure = 1 + abs(neighbor[0]-adjacent[0]) + abs(neighbor[1]-adjacent[1])  # The L1-distance from the adjacent cell to the base (Manhattan Distance).
+            step = self.steps_to_treasure.get((pirate_location, treasure_location))
+            if step is None:
+                distance, neighbor_step = float('inf'), None
+                # For each adjacent cell of the treasure (from which we can collect this treasure), we will calculate the distance from the pirate ship to it.
+                for adjacent in self.simulator.neighbors(treasure_location):
+                    # Find the direction closest to the treasure as the direction we want to sail to.
+                    for neighbor in self.simulator.neighbors(pirate_location):
+                        temp_dist_to_treasure = 1 + abs(neighbor[0]-adjacent[0]) + abs(neighbor[1]-adjacent[1])  # The L1-distance from the adjacent cell to the base (Manhattan Distance).
+                        if temp_dist_to_treasure < distance:
+                            distance, neighbor_step = temp_dist_to_treasure, neighbor
+                step = self.steps_to_treasure[(pirate_location, treasure_location)] = (distance, neighbor_step)
 
-                    # Update the distance from the treasure to the base if the new distance is shorter.
-                    if temp_dist_to_treasure < min_distances_to_treasure:
-                        min_distances_to_treasure = temp_dist_to_treasure
-                        min_dist_to_treasure_neighbor = neighbor
+            # Update the distance from the treasure to the base if the new distance is shorter.
+            if step[0] < min_distances_to_treasure:
+                min_distances_to_treasure, min_dist_to_treasure_neighbor = step
 
             # We define the score for each treasure as the ratio between the reward we can get from it and the shortest distance from the pirate ship to it.
             scores[t] = (treasure_reward / min_distances_to_treasure, min_dist_to_treasure_neighbor)
-        sail_to = max(scores, key=lambda x: x[0])[1]  # The location we want to sail to in order to reach the treasure is the one with the highest score.
-        # If the location we want to sail to has a marine ship, we will wait.
-        if self.collision_with_marine(sail_to, marine_locations):
-            return ('wait', pirate_ship)
-        return ('sail', pirate_ship, sail_to)
+        return max(scores, key=lambda x: x[0])[1]  # The location we want to sail to in order to reach the treasure is the one with the highest score.
 
 
         
@@ -143,28 +151,44 @@ class UCTNode:
     """
     A class for a single node. not mandatory to use but may help you.
     """
-    def __init__(self, parent=None, action=None, player_number=0):
+    def __init__(self, parent=None, action=None, player_number=0, ship=0, mover=None):
         # Initialize the node with the parent node, the action that was taken to reach this node and the player number.
         # We also have a list of the children of this node, the sum of the scores and the number of visits.
+        # player_number is the player to move in this node, and mover the player whose action led to it.
+        # In the factored mode of UCTAgent, actions are atomic: ship is the index (among the ships of player_number)
+        # of the ship that decides in this node, and the mover may be the player to move as well.
         self.parent = parent
         self.action = action
         self.player_number = player_number
+        self.ship = ship
+        self.mover = 3 - player_number if mover is None else mover
         self.children = list()
         self.sum_score = 0
         self.visits = 0
+        # With progressive widening, the actions that have no child yet, best first (None until first expanded).
+        self.untried = None
+        # With RAVE, the all-moves-as-first statistics of the atomic actions of player_number below this node:
+        # a dict from an atomic action to [visits, wins of player_number] (None until first updated).
+        self.amaf = None
+        # The number of searching threads that are below this node right now (tree-parallel mode), each counted
+        # as a lost visit until it backpropagates, so that the other threads spread out.
+        self.virtual_loss = 0
     
-    def select_using_uct(self):
+    def select_using_uct(self, statistics=None):
         # UCT formula
-        if self.visits == 0:
+        # statistics - the [visits, sum of scores] of a transposition table entry to use instead of the node's own.
+        visits, sum_score = (self.visits, self.sum_score) if statistics is None else statistics
+        visits += self.virtual_loss
+        if visits == 0:
             return float('inf')
-        return self.sum_score / self.visits + (2 * math.log(self.parent.visits) / self.visits) ** 0.5
+        parent_visits = max(self.parent.visits + self.parent.virtual_loss, 1)
+        return sum_score / visits + (2 * math.log(parent_visits) / visits) ** 0.5
     
     def update_node(self, result):
         # result is a dictionary with player 1 and player 2 scores.
-        # we calculate here the score of the node
-        # 3 - self.player_number is the rival player number
+        # we calculate here the score of the node, from the point of view of the player whose action led to it.
         self.visits += 1
-        is_winner = result['player '+str(self.player_number)] > result['player '+str(3 - self.player_number)]
+        is_winner = result['player '+str(self.mover)] > result['player '+str(3 - self.mover)]
         if is_winner > 0:
             self.sum_score += 1
 
@@ -178,140 +202,1110 @@ class UCTNode:
 class UCTAgent:
     # We decided to initialize the agent with the initial state and the player number that are given.
     # We also have a list of the ships that belong to the agent and a list of the ships that belong to the rival.
-    def __init__(self, initial_state, player_number):
+    # rollout_batch_size - if positive, every simulation runs that many rollouts at once on the NumPy BatchedSimulator.
+    # seed - seeds the agent's own random generator; the simulators it builds draw from child streams of it.
+    # reuse_tree - keep the search tree between turns, re-rooted at the node reached by our action and the rival's reply.
+    # factored - expand one ship at a time: every tree level decides the atomic action of a single ship, instead of
+    #            branching over the Cartesian product of all the ships' actions.
+    # rollout_policy - the default policy of the rollouts, a function (simulator, player_number, rng) -> joint action,
+    #                  or one of 'uniform', 'greedy' (plays as our greedy Agent) and 'epsilon-greedy'.
+    # rollout_epsilon - the probability of a random action in the 'epsilon-greedy' rollout policy.
+    # array_tree - keep the tree in a TreeStore of parallel arrays instead of UCTNode objects (joint expansion,
+    #              a single thread and no transposition table).
+    # widening - (c, alpha) for progressive widening: a node visited n times has at most ceil(c * n ** alpha) children,
+    #            created lazily in the order of a heuristic (deposit, collect, plunder, sail, wait).
+    # vectorized - select children on the array tree (implies array_tree) with NumPy, scoring a whole block of
+    #              children in one call.
+    # rave - if positive, the RAVE equivalence parameter k: the UCT value of a child blends its mean score with the
+    #        all-moves-as-first score of its atomic actions, with the weight sqrt(k / (3 * visits + k)) on the latter.
+    # event_tapes - if positive, that many EventTapes of treasure arrivals and marine moves are drawn here, for a whole
+    #               game, and the iterations take turns playing against them (the batched rollouts draw their own).
+    #               The actions of the tree are then compared against the same futures, and no iteration draws
+    #               random events of its own.
+    # ponder - keep searching in a process of its own between act() calls, from the state after our action (so over
+    #          the rival's replies), with the joint tree; the next act() adds the statistics of our actions after the
+    #          rival's actual reply to its root. The rival runs in our interpreter (main.py), so the pondering is
+    #          dropped on a single core, where it could only take time from the rival's act().
+    # workers - if positive, root-parallel search: every turn that many processes search the same state independently
+    #           (each with its own random stream) and their root statistics are merged. The process pool is started here,
+    #           so the turns don't pay for it. The tree is not kept between turns in this mode.
+    # threads - if more than 1, tree-parallel search: that many threads search one shared tree, with virtual loss
+    #           and locks on the nodes statistics. It pays off on free-threaded builds and with batched rollouts.
+    # action_timeout - the seconds main.py allows an act() call (main.ACTION_TIMEOUT), the TimeManager budgets from it.
+    # transposition_megabytes - if positive, nodes that take the same action in the same state share its statistics
+    #                           through a transposition table of (about) that size, kept for the whole game.
+    # rollout_horizon - if positive, rollouts stop after that many turns and the LeafEvaluator scores their last state
+    #                   (batched rollouts still play to the end).
+    # book_path - the file of an OpeningBook: the searches of our first book_moves positions add the stored root
+    #             statistics (scaled down to book_visits visits) to their root, and their own root statistics are
+    #             appended to its log after our last act() of the game (or by close(), or at exit).
+    #             The stored statistics seed the joint tree (UCTNode or array, new or kept) and the merged
+    #             root-parallel statistics.
+    def __init__(self, initial_state, player_number, rollout_batch_size=0, seed=None, reuse_tree=True, factored=False,
+                 rollout_policy=uniform_policy, workers=0, threads=1, action_timeout=5, transposition_megabytes=0,
+                 rollout_horizon=0, rollout_epsilon=0.1, array_tree=False, widening=None, vectorized=False,
+                 rave=0, ponder=False, book_path=None, book_moves=10, book_visits=1000, event_tapes=0):
         self.ids = IDS
         self.player_number = player_number
         self.my_ships = list()
         self.rival_ships = list()
-        self.simulator = Simulator(initial_state)
+        self.rng = random.Random(seed)
+        self.simulator = Simulator(initial_state, self.rng.getrandbits(64))
         self.agent = Agent(initial_state, player_number)
         for ship_name, ship in initial_state['pirate_ships'].items():
             if ship['player'] == player_number:
                 self.my_ships.append(ship_name)
             else:
                 self.rival_ships.append(ship_name)
+        self.rollout_batch_size = rollout_batch_size
+        if rollout_batch_size:
+            # The batched simulator is imported only when batched rollouts are used.
+            import numpy as np
+            from batched_simulator import BatchedSimulator
+            self.batched_simulator_class = BatchedSimulator
+            self.batch_rng = np.random.default_rng(self.rng.getrandbits(64))
+        self.reuse_tree = reuse_tree
+        self.factored = factored
+        self.widening = widening
+        self.rave = rave
+        if rollout_policy == 'uniform':
+            playout_policy = uniform_policy
+        elif rollout_policy == 'greedy':
+            playout_policy = GreedyPolicy(initial_state, Agent)
+        elif rollout_policy == 'epsilon-greedy':
+            playout_policy = EpsilonGreedyPolicy(GreedyPolicy(initial_state, Agent), rollout_epsilon)
+        else:
+            playout_policy = rollout_policy
+        if rollout_horizon:
+            self.rollout_engine = RolloutEngine(playout_policy, self.rng, rollout_horizon,
+                                                LeafEvaluator.from_state(initial_state))
+        else:
+            self.rollout_engine = RolloutEngine(playout_policy, self.rng)
+        self.workers = workers
+        self.pool = None
+        # The options of the agents of the worker and pondering processes.
+        options = {'rollout_batch_size': rollout_batch_size, 'reuse_tree': False, 'factored': factored,
+                   'rollout_policy': rollout_policy, 'transposition_megabytes': transposition_megabytes,
+                   'rollout_horizon': rollout_horizon, 'rollout_epsilon': rollout_epsilon,
+                   'array_tree': array_tree, 'widening': widening, 'vectorized': vectorized, 'rave': rave,
+                   'event_tapes': event_tapes}
+        if workers:
+            self.pool = ProcessPoolExecutor(workers, initializer=_start_worker,
+                                            initargs=(initial_state, player_number, options))
+            # The pool starts its processes on demand, so we keep them all busy once to have them ready.
+            for future in [self.pool.submit(_worker_ready, 0.5) for _ in range(workers)]:
+                future.result()
+        self.time_manager = TimeManager(action_timeout)
+        self.tree_store = None
+        self.vectorized = vectorized
+        if vectorized:
+            import numpy as np
+            self.np = np
+            # log_terms[n] - the 2 * log(n) of the UCT formula, for a parent visited n times.
+            self.log_terms = [0.0]
+            array_tree = True
+        if array_tree:
+            if factored or threads > 1 or transposition_megabytes or widening or rave:
+                raise ValueError("The array tree supports only the joint, single-threaded search!")
+            self.tree_store = TreeStore()
+        self.transposition_table = TranspositionTable(transposition_megabytes) if transposition_megabytes else None
+        self.threads = threads
+        self.thread_pool = None
+        if threads > 1:
+            self.thread_pool = ThreadPoolExecutor(threads)
+            # Striped locks: a node is guarded by the lock of its id, so there is no lock object per node.
+            self.node_locks = [threading.Lock() for _ in range(64)]
+        # The node of our last chosen action, and a simulator in the state right after we applied it.
+        self.last_choice = None
+        self.after_last_choice = None
+        # The draws of a tape are fractions that fit any state, and a search reads them from its root on,
+        # so the same tapes serve every turn.
+        self.event_tapes = [EventTape.for_simulator(self.simulator, self.rng) for _ in range(event_tapes)]
+        self.ponder = (ponder and reuse_tree and not workers and not array_tree and not factored
+                       and (os.cpu_count() or 1) > 1)
+        self.ponder_pool = None
+        # The pondering search in progress, and its result: (visits, statistics of our actions) per rival action.
+        self.ponder_future = None
+        self.pondered = None
+        if self.ponder:
+            self.ponder_stop = multiprocessing.Event()
+            self.ponder_pool = ProcessPoolExecutor(1, initializer=_start_ponderer,
+                                                   initargs=(initial_state, player_number, options, self.ponder_stop))
+            self.ponder_pool.submit(_worker_ready, 0).result()
+        self.book = None
+        if book_path is not None:
+            self.book = OpeningBook(book_path)
+            # main.py doesn't call close(), so a game cut short is written at exit.
+            atexit.register(self.book.flush)
+            self.book_moves = book_moves
+            self.book_visits = book_visits
+            # The statistics the book gave the current root, which are not written back with the searched ones.
+            self.book_prior = {}
+            self.recorded_moves = self.book_lookups = 0
+            # The lookup of our first position is done here, so the first turn doesn't pay for it. As player 2, it
+            # follows the rival's first action, so the position after each of them is looked up (without guessing
+            # the treasure that may arrive with it).
+            initial_simulator = Simulator(initial_state)
+            positions = [initial_simulator]
+            if player_number == 2:
+                positions = []
+                for action in initial_simulator.legal_actions(1):
+                    position = initial_simulator.clone()
+                    position.apply_action(action, 1)
+                    positions.append(position)
+            keys = [OpeningBook.state_key(position, player_number) for position in positions]
+            self.book_entries = {key: self.book.get(key) for key in keys}
+
+    def ships_of(self, player_number):
+        ''' Returns the ships of the given player. '''
+        return self.my_ships if player_number == self.player_number else self.rival_ships
+
+    def legal_ship_actions(self, node, simulator, partial_action):
+        '''
+        In the factored mode, returns the set of legal atomic actions of the ship that decides in the node,
+        given the actions already chosen for the player's previous ships in this turn (partial_action):
+        two ships cannot collect the same treasure.
+        '''
+        ship = self.ships_of(node.player_number)[node.ship]
+        taken = {atomic_action[2] for atomic_action in partial_action if atomic_action[0] == 'collect'}
+        return {atomic_action for atomic_action in simulator.legal_atomic_actions(ship)
+                if atomic_action[0] != 'collect' or atomic_action[2] not in taken}
+
+    def is_legal(self, action, player_number, simulator):
+        ''' Returns True if every atomic action of the (generated, so never mutex) joint action is legal. '''
+        legal_atomic_actions = set()
+        for ship in self.ships_of(player_number):
+            legal_atomic_actions.update(simulator.legal_atomic_actions(ship))
+        return all(atomic_action in legal_atomic_actions for atomic_action in action)
+
+    def available_children(self, node, simulator, partial_action=()):
+        '''
+        Returns the children of the node whose actions are legal in the current state of the simulator.
+        The tree is shared by rollouts that met different random events (and by earlier turns), so some of its
+        actions may refer to treasures that are not there anymore.
+        '''
+        if self.factored:
+            legal = self.legal_ship_actions(node, simulator, partial_action)
+            return [child for child in node.children if child.action in legal]
+        legal_atomic_actions = set()
+        for ship in self.ships_of(node.player_number):
+            legal_atomic_actions.update(simulator.legal_atomic_actions(ship))
+        return [child for child in node.children
+                if all(atomic_action in legal_atomic_actions for atomic_action in child.action)]
+
+    def play_turn(self, simulator, action, player_number):
+        '''
+        Applies the (generated, so trusted) joint action of the player. After player 2 acts the round ends, as in
+        main.py and RolloutEngine.run: marine collisions are checked and the marines move.
+        '''
+        simulator.act(action, player_number, trusted=True)
+        if player_number == 2:
+            simulator.check_collision_with_marines()
+            simulator.move_marines()
+
+    def descend(self, node, child, simulator, partial_action):
+        '''
+        Moves from the node to its child: applies the child's action to the simulator and returns the partial action
+        of the turn in progress. In the factored mode the atomic actions are gathered until the last ship of the
+        player decided, and only then the joint action is applied (with the end of the round after player 2).
+        '''
+        if not self.factored:
+            self.play_turn(simulator, child.action, node.player_number)
+            return []
+        partial_action = partial_action + [child.action]
+        if len(partial_action) == len(self.ships_of(node.player_number)):
+            self.play_turn(simulator, tuple(partial_action), node.player_number)
+            return []
+        return partial_action
+
+    def finish_turn(self, node, simulator, partial_action):
+        '''
+        In the factored mode, a node may be in the middle of a turn. This completes the turn with random legal atomic
+        actions for the remaining ships and applies it. Returns the player to move next.
+        '''
+        player_number = node.player_number
+        if not partial_action:
+            return player_number
+        action = list(partial_action)
+        taken = {atomic_action[2] for atomic_action in action if atomic_action[0] == 'collect'}
+        for ship in self.ships_of(player_number)[len(action):]:
+            atomic_action = self.rng.choice([atomic_action for atomic_action in simulator.legal_atomic_actions(ship)
+                                             if atomic_action[0] != 'collect' or atomic_action[2] not in taken])
+            if atomic_action[0] == 'collect':
+                taken.add(atomic_action[2])
+            action.append(atomic_action)
+        self.play_turn(simulator, tuple(action), player_number)
+        return 3 - player_number
+
+    def state_signature(self, simulator):
+        '''
+        The deterministic part of a state that tells the rival's actions apart: ships locations and capacities,
+        the treasures they hold and the turns to go (treasure arrivals and marine moves are left out).
+        '''
+        game_state = simulator.game_state
+        held = sorted((name, location) for name, (location, _) in game_state.treasures.items() if type(location) == str)
+        return (tuple(game_state.ship_locations), tuple(game_state.ship_capacities), tuple(held),
+                game_state.turns_to_go)
+
+    def turn_children(self, node):
+        '''
+        Yields (joint action, node) for every node of the tree reached from the given node by one whole turn
+        of the player to move in it - its children, or in the factored mode its descendants one ship-level per ship.
+        '''
+        if not self.factored:
+            for child in node.children:
+                yield child.action, child
+            return
+        ships_count = len(self.ships_of(node.player_number))
+        stack = [(node, ())]
+        while stack:
+            current, partial_action = stack.pop()
+            if len(partial_action) == ships_count:
+                yield partial_action, current
+                continue
+            for child in current.children:
+                stack.append((child, partial_action + (child.action,)))
+
+    def reuse_root(self, simulator):
+        '''
+        Finds the node of the current state in the tree kept from our last turn: the node under our last chosen action
+        whose rival action, followed by the collisions of the end of the round, leads to the state of the simulator.
+        Returns it detached from its parent (dropping the siblings), or None if no rival action explains the state.
+        '''
+        last_choice, after_last_choice = self.last_choice, self.after_last_choice
+        self.last_choice = self.after_last_choice = None
+        pondered, self.pondered = self.pondered, None
+        if last_choice is None:
+            return None
+        observed = self.state_signature(simulator)
+        reused = None
+        for action, node in self.turn_children(last_choice):
+            if self.explains(action, after_last_choice, observed) and (reused is None or node.visits > reused.visits):
+                reused = node
+        if reused is not None:
+            reused.parent = None
+        if pondered:
+            reused = self.adopt_pondered(reused, pondered, after_last_choice, observed, simulator)
+        return reused
+
+    def adopt_pondered(self, root, pondered, after_last_choice, observed, simulator):
+        '''
+        Adds the pondered statistics of our actions after the rival's reply (the most visited rival action that
+        explains the observed state) to the children of the root, which is created if the tree had no node for it.
+        Actions that are not legal in the state of the simulator are left out.
+        '''
+        replies = [(visits, statistics) for action, (visits, statistics) in pondered.items()
+                   if self.explains(action, after_last_choice, observed)]
+        if not replies:
+            return root
+        _, statistics = max(replies, key=lambda reply: reply[0])
+        if root is None:
+            root = UCTNode(player_number=self.player_number)
+        self.add_root_statistics(root, [(action, visits, sum_score) for action, visits, sum_score in statistics
+                                        if self.is_legal(action, self.player_number, simulator)])
+        return root
+
+    def explains(self, action, after_last_choice, observed):
+        '''
+        Returns True if the rival's action, applied after our last action (and followed by the collisions of the end
+        of the round), leads to the observed state signature.
+        '''
+        rival = 3 - self.player_number
+        candidate = after_last_choice.clone()
+        # The round ends (collisions are checked) after player 2 acts. If we are player 2, the collisions come before
+        # the rival's action, and a collision (that empties a ship) may be what made it legal.
+        if rival == 1:
+            candidate.check_collision_with_marines()
+        if not self.is_legal(action, rival, candidate):
+            return False
+        candidate.apply_action(action, rival)
+        if rival == 2:
+            candidate.check_collision_with_marines()
+        return self.state_signature(candidate) == observed
 
-    def selection(self, root):
+    def selection(self, root, simulator):
         '''
         The selection function is used to select a child node to explore, acordingly to the UCT formula and MCTS algorithm.
+        The actions on the way down are applied to the simulator, so it ends up in the state of the selected node.
+        Returns the selected node, the partial action of the turn in progress (always empty unless factored)
+        and the path of (transposition table entry, mover) pairs of the actions taken (empty without a table).
         '''
         curr_node = root        
+        partial_action = []
+        path = []
+        table = self.transposition_table
+        if self.thread_pool is not None:
+            self.add_virtual_loss(root)
         while curr_node.children:
+            if self.widening is not None and self.can_widen(curr_node):
+                # The node gets another child before we go deeper.
+                break
+            children = self.available_children(curr_node, simulator, partial_action)
+            if not children:
+                # Every child is stale in this state, the node will be expanded again.
+                break
+            if table is not None:
+                # The key of an action is the state, the actions already chosen in the turn and the action itself.
+                key_prefix = (table.state_key(simulator), tuple(partial_action))
             max_uct_value = float('-inf')
             max_uct_children = []
-            for child in curr_node.children:              
-                uct_value = child.select_using_uct()
+            for child in children:              
+                statistics = None if table is None else table.get(key_prefix + (child.action,))
+                if self.rave:
+                    uct_value = self.rave_uct(curr_node, child, statistics)
+                else:
+                    uct_value = child.select_using_uct(statistics)
                 if uct_value > max_uct_value:
                     max_uct_value = uct_value
                     max_uct_children = [child]
                 elif uct_value == max_uct_value:
                     max_uct_children.append(child)
 
-            curr_node = random.choice(max_uct_children)
-        return curr_node
+            child = self.rng.choice(max_uct_children)
+            if self.thread_pool is not None:
+                self.add_virtual_loss(child)
+            if table is not None:
+                path.append((table.entry(key_prefix + (child.action,)), child.mover))
+            partial_action = self.descend(curr_node, child, simulator, partial_action)
+            curr_node = child
+        return curr_node, partial_action, path
     
 
-    def get_legal_actions(self, state, player_number):
+    def get_legal_actions(self, simulator, player_number):
         '''
         The get_legal_actions function is used to get all the legal actions that the agent can take in the current state.
+        The actions are generated by the simulator, so they can be applied with act(..., trusted=True).
         '''
-        actions = {}
-        collected_treasures = []
-        ships = self.my_ships if player_number == self.player_number else self.rival_ships
-        for ship in ships:
-            actions[ship] = set()
-            # Get all the neighboring tiles of the ship - only the ones that are sea tiles.
-            neighboring_tiles = self.simulator.neighbors(state["pirate_ships"][ship]["location"])
-            for tile in neighboring_tiles:
-                actions[ship].add(("sail", ship, tile))
-            # check if we can do a collect action
-            if state["pirate_ships"][ship]["capacity"] > 0:
-                for treasure in state["treasures"].keys():
-                    if state["pirate_ships"][ship]["location"] in self.simulator.neighbors(state["treasures"][treasure]["location"])\
-                        and treasure not in collected_treasures:
-                        actions[ship].add(("collect", ship, treasure))
-                        collected_treasures.append(treasure)
-            for treasure in state["treasures"].keys():
-                # check if we can do a deposit action
-                if (state["pirate_ships"][ship]["location"] == state["base"]
-                        and state["treasures"][treasure]["location"] == ship):
-                    actions[ship].add(("deposit", ship, treasure))
-            for enemy_ship_name in state["pirate_ships"].keys():
-                # check if we can do a plunder action
-                if (state["pirate_ships"][ship]["location"] == state["pirate_ships"][enemy_ship_name]["location"] and
-                        self.player_number != state["pirate_ships"][enemy_ship_name]["player"]):
-                    actions[ship].add(("plunder", ship, enemy_ship_name))
-            actions[ship].add(("wait", ship))
-        return list(product(*actions.values()))
+        return simulator.legal_actions(player_number)
 
         
     # def expansion(self, UCT_tree, parent_node):
-    def expansion(self, state, parent_node):
+    def expansion(self, simulator, parent_node, partial_action=()):
         ''' 
         The expansion is as learned in class based on MCTS algorithm. 
         It is used to expand the tree and choose randomly a child node to explore.
+        Actions that already have a child node are not added again.
+        In the factored mode the children are the atomic actions of the next ship to decide.
         '''
-        for action in self.get_legal_actions(state, parent_node.player_number):
-            new_node = UCTNode(parent_node, action, 3 - parent_node.player_number)
+        if self.thread_pool is not None:
+            with self.lock_of(parent_node):
+                return self.expand(simulator, parent_node, partial_action)
+        return self.expand(simulator, parent_node, partial_action)
+
+    def expand(self, simulator, parent_node, partial_action):
+        ''' The body of expansion(), which the tree-parallel mode runs under the lock of the parent node. '''
+        if self.widening is not None:
+            return self.widen(simulator, parent_node, partial_action)
+        existing_actions = {child.action for child in parent_node.children}
+        if self.factored:
+            for action in self.legal_ship_actions(parent_node, simulator, partial_action):
+                if action not in existing_actions:
+                    parent_node.children.append(self.child_node(parent_node, action))
+            return self.rng.choice(parent_node.children)
+        for action in self.get_legal_actions(simulator, parent_node.player_number):
+            if action in existing_actions:
+                continue
+            new_node = self.child_node(parent_node, action)
             parent_node.children.append(new_node)
-        return random.choice(parent_node.children)
+        return self.rng.choice(parent_node.children)
+
+    def child_node(self, parent_node, action):
+        ''' Returns a new child of the node for the action (atomic in the factored mode, joint otherwise). '''
+        if not self.factored:
+            return UCTNode(parent_node, action, 3 - parent_node.player_number)
+        player_number, ship = parent_node.player_number, parent_node.ship + 1
+        if ship == len(self.ships_of(player_number)):
+            player_number, ship = 3 - player_number, 0
+        return UCTNode(parent_node, action, player_number, ship, mover=parent_node.player_number)
+
+    # The heuristic order of progressive widening, by the kinds of the atomic actions.
+    ACTION_PRIORITIES = {'deposit': 4, 'collect': 3, 'plunder': 2, 'sail': 1, 'wait': 0}
+
+    def allowed_children(self, node):
+        c, alpha = self.widening
+        return math.ceil(c * (node.visits + 1) ** alpha)
+
+    def can_widen(self, node):
+        ''' Returns True if the node may get another child, by its visits and the actions it has not tried. '''
+        return node.untried is None or (bool(node.untried) and len(node.children) < self.allowed_children(node))
 
-    def simulation(self, node, turns_to_go, simulator):
+    def widen(self, simulator, parent_node, partial_action):
+        '''
+        Progressive widening: adds children to the node, in the heuristic order of its untried actions, up to the
+        number its visits allow. The untried actions are generated (and ordered) the first time the node is
+        expanded; those that are not legal in the current state are skipped, and kept for later.
+        '''
+        if self.factored:
+            legal = self.legal_ship_actions(parent_node, simulator, partial_action)
+            is_legal = legal.__contains__
+        else:
+            legal = self.get_legal_actions(simulator, parent_node.player_number)
+            is_legal = lambda action: self.is_legal(action, parent_node.player_number, simulator)
+        if parent_node.untried is None:
+            existing_actions = {child.action for child in parent_node.children}
+            priorities = self.ACTION_PRIORITIES
+            priority = lambda action: priorities[action[0]] if self.factored else sum(
+                priorities[atomic_action[0]] for atomic_action in action)
+            # Random keys break the ties, so equally good actions are not tried in the generator's order.
+            parent_node.untried = sorted((action for action in legal if action not in existing_actions),
+                                         key=lambda action: (-priority(action), self.rng.random()))
+        allowed = self.allowed_children(parent_node)
+        untried = []
+        for action in parent_node.untried:
+            if len(parent_node.children) < allowed and is_legal(action):
+                parent_node.children.append(self.child_node(parent_node, action))
+            else:
+                untried.append(action)
+        parent_node.untried = untried
+        return self.rng.choice(parent_node.children) if parent_node.children else None
+
+    def simulation(self, node, simulator, partial_action=(), played=None):
         '''
         The simulation function is based on the MCTS algorithm as we learned in class.
         It is used to simulate the game until the end and return the score so we can backpropagate it.
+        The rollout completes the turn in progress (in the factored mode) and is then played by the rollout engine,
+        with its default policy and without adding nodes to the tree.
+        The rollout's (player_number, joint action) are appended to played, if it is given.
         '''
-        if turns_to_go == 0:
-            return simulator.get_score()  # Score is a dictionary with player 1 and player 2 scores.
-        if node.children:
-            treasures = self.simulator.state["treasures"].keys()
-            children_nodes = list()
-            for child in node.children:
-                # check if we can do a collect action, if not, we won't choose this child node to explore.
-                # This is because the function in simulator do not check if the treasure is already collected/vinish.
-                flag = False
-                for atomic_action in child.action:
-                    if ((atomic_action[0] == "collect") and (atomic_action[2] not in treasures)):
-                        flag = True
-                        break
-                if not flag:
-                    children_nodes.append(child)
-            child_node = random.choice(children_nodes)
-        else:
-            # If there are no children nodes, we will expand the tree and choose randomly a child node to explore.
-            child_node = self.expansion(simulator.state, node)
-        simulator.act(child_node.action, node.player_number)
-        return self.simulation(child_node, (turns_to_go - 1), simulator)
+        player_number = self.finish_turn(node, simulator, partial_action)
+        return self.rollout_engine.run(simulator, player_number, played)
 
+    def batched_simulation(self, node, simulator, partial_action=()):
+        '''
+        Runs rollout_batch_size random rollouts at once from the state of the node, on the batched simulator.
+        Returns the final score of each rollout.
+        '''
+        return self.batched_rollouts(simulator, self.finish_turn(node, simulator, partial_action))
 
-    def backpropagation(self, node, simulation_result):
+    def batched_rollouts(self, simulator, player_number):
+        ''' Runs the batched rollouts from the state of the simulator, where the given player is to move. '''
+        batch = self.batched_simulator_class.from_simulator(simulator, self.rollout_batch_size, self.batch_rng)
+        scores = batch.rollout(player_number)
+        return [{'player 1': score_1, 'player 2': score_2} for score_1, score_2 in scores.tolist()]
+
+    def backpropagation(self, node, simulation_result, path=(), played=()):
         '''
         The backpropagation function is used to update the nodes in the tree with the simulation result,
-        as we learned in class, based on the MCTS algorithm.'''
+        as we learned in class, based on the MCTS algorithm.
+        The transposition table entries on the path of the selection are updated as well,
+        and so are the RAVE statistics, with the rollout's played actions.'''
+        for entry, mover in path:
+            entry[0] += 1
+            if simulation_result['player ' + str(mover)] > simulation_result['player ' + str(3 - mover)]:
+                entry[1] += 1
+        if self.rave:
+            self.update_amaf(node, simulation_result, played)
+        if self.thread_pool is not None:
+            while node is not None:
+                with self.lock_of(node):
+                    node.update_node(simulation_result)
+                node = node.parent
+            return
         while node is not None:
             node.update_node(simulation_result)
             node = node.parent
 
+    def update_amaf(self, node, simulation_result, played):
+        '''
+        All-moves-as-first: every node on the way up from the given node to the root counts the result for every
+        atomic action its player_number played below it, in the tree or in the rollout, as if it was played first.
+        '''
+        played_below = {1: set(), 2: set()}
+        for player_number, action in played:
+            played_below[player_number].update(action)
+        while node is not None:
+            player_number = node.player_number
+            win = (simulation_result['player ' + str(player_number)] >
+                   simulation_result['player ' + str(3 - player_number)])
+            if self.thread_pool is not None:
+                with self.lock_of(node):
+                    self.count_amaf(node, played_below[player_number], win)
+            else:
+                self.count_amaf(node, played_below[player_number], win)
+            if node.parent is not None:
+                if self.factored:
+                    played_below[node.mover].add(node.action)
+                else:
+                    played_below[node.mover].update(node.action)
+            node = node.parent
+
+    @staticmethod
+    def count_amaf(node, atomic_actions, win):
+        if node.amaf is None:
+            node.amaf = {}
+        amaf = node.amaf
+        for atomic_action in atomic_actions:
+            statistics = amaf.get(atomic_action)
+            if statistics is None:
+                statistics = amaf[atomic_action] = [0, 0]
+            statistics[0] += 1
+            if win:
+                statistics[1] += 1
+
+    def rave_uct(self, parent, child, statistics=None):
+        '''
+        The UCT value of the child with RAVE: its mean score is blended with the AMAF mean of its atomic actions
+        at the parent, by the weight sqrt(k / (3 * visits + k)), which fades as the child is visited.
+        The child's visits and score come from its transposition table entry if given (the AMAF statistics stay
+        in the parent node).
+        '''
+        child_visits, sum_score = (child.visits, child.sum_score) if statistics is None else statistics
+        visits = child_visits + child.virtual_loss
+        if visits == 0 or parent.amaf is None:
+            return child.select_using_uct(statistics)
+        amaf_visits = amaf_wins = 0
+        for atomic_action in ((child.action,) if self.factored else child.action):
+            statistics = parent.amaf.get(atomic_action)
+            if statistics is not None:
+                amaf_visits += statistics[0]
+                amaf_wins += statistics[1]
+        if amaf_visits == 0:
+            return child.select_using_uct(statistics)
+        beta = (self.rave / (3 * visits + self.rave)) ** 0.5
+        parent_visits = max(parent.visits + parent.virtual_loss, 1)
+        return ((1 - beta) * sum_score / visits + beta * amaf_wins / amaf_visits
+                + (2 * math.log(parent_visits) / visits) ** 0.5)
+
+    def lock_of(self, node):
+        ''' The lock guarding the statistics and the children of a node in the tree-parallel mode. '''
+        return self.node_locks[id(node) % len(self.node_locks)]
+
+    def add_virtual_loss(self, node, amount=1):
+        with self.lock_of(node):
+            node.virtual_loss += amount
+
+    def release_virtual_loss(self, node):
+        ''' Removes the virtual loss of a finished iteration from the node and its ancestors. '''
+        while node is not None:
+            self.add_virtual_loss(node, -1)
+            node = node.parent
+
+    def child_statistics(self, simulator, partial_action=()):
+        '''
+        Returns a function from a child of the node reached by partial_action from the root (the simulator is in the
+        root's state) to its visits and sum of scores: those of its transposition table entry when the table is
+        enabled and has one, since the table also counts the visits of the same action through other paths.
+        '''
+        table = self.transposition_table
+        if table is None:
+            return lambda child: (child.visits, child.sum_score)
+        key_prefix = (table.state_key(simulator), tuple(partial_action))
+
+        def statistics(child):
+            entry = table.get(key_prefix + (child.action,))
+            return (child.visits, child.sum_score) if entry is None else (entry[0], entry[1])
+        return statistics
+
+    def best_child(self, root, simulator):
+        '''
+        Returns the action to play and the tree node it leads to (None if the tree does not cover all of it).
+        In the factored mode, the action is built ship by ship along the best children, and ships below the explored
+        part of the tree get a random legal action. So does the whole action if the root has no children.
+        '''
+        def mean_score(statistics):
+            def mean(child):
+                visits, sum_score = statistics(child)
+                return sum_score / visits if visits else float("inf")  # No exploration
+            return mean
+        if not self.factored:
+            if not root.children:
+                return self.rng.choice(self.get_legal_actions(simulator, self.player_number)), None
+            child = max(root.children, key=mean_score(self.child_statistics(simulator)))
+            return child.action, child
+        node, partial_action = root, []
+        for _ in self.my_ships:
+            children = self.available_children(node, simulator, partial_action)
+            if not children:
+                legal = sorted(self.legal_ship_actions(node, simulator, partial_action))
+                partial_action.append(self.rng.choice(legal))
+                node = UCTNode(node, partial_action[-1], node.player_number, node.ship + 1, node.player_number)
+                continue
+            node = max(children, key=mean_score(self.child_statistics(simulator, partial_action)))
+            partial_action.append(node.action)
+        complete = node.player_number != self.player_number or not self.my_ships
+        return tuple(partial_action), node if complete and node.parent is not None else None
+
+
+    def is_critical(self, simulator):
+        '''
+        A turn is critical (and gets more search time) near the end of the game, when our ships hold treasures,
+        or when one of them can collect, deposit or plunder.
+        '''
+        if simulator.turns_to_go <= 10:
+            return True
+        my_ships = set(self.my_ships)
+        if any(location in my_ships for location, _ in simulator.game_state.treasures.values()):
+            return True
+        return any(atomic_action[0] != 'sail' and atomic_action[0] != 'wait'
+                   for ship in self.my_ships for atomic_action in simulator.legal_atomic_actions(ship))
+
+    def search(self, state, start_time, time_limit=None):
+        '''
+        Runs the MCTS iterations from the given state, and returns the root of the tree and the simulator
+        (back in the state of the root). The search ends when the time manager says so, or after time_limit seconds
+        since start_time if it is given.
+        '''
+        # All the iterations run on this single simulator: each one walks down the tree and rolls out in place,
+        # and is then undone back to the root state.
+        simulator = Simulator(state, self.rng.getrandbits(64))
+        if self.tree_store is not None:
+            return self.array_search(simulator, start_time, time_limit), simulator
+        root = self.reuse_root(simulator) if self.reuse_tree else None
+        if root is None:
+            root = UCTNode(player_number=self.player_number)
+        elif root.children:
+            # The statistics of the kept subtree carry over, and stale root actions are dropped.
+            root.children = self.available_children(root, simulator)
+            root.untried = None
+        if self.book is not None and not self.factored:
+            self.seed_root(root, simulator)
+        if root.children:
+            # The other legal actions are added next to the kept and the book's ones.
+            self.expansion(simulator, root)
+        self.time_manager.start_turn(start_time, self.is_critical(simulator), time_limit)
+        if self.thread_pool is None:
+            self.search_loop(root, simulator)
+        else:
+            # Every thread walks the shared tree on a simulator of its own.
+            futures = [self.thread_pool.submit(self.search_loop, root, simulator.clone(self.rng.getrandbits(64)))
+                       for _ in range(self.threads)]
+            for future in futures:
+                future.result()
+        return root, simulator
+
+    def next_tape(self, simulator, iteration):
+        '''
+        With event tapes, attaches the tape of the given iteration to the simulator (in the root state, the tape is
+        read from its start). Returns the number of the next iteration.
+        '''
+        if self.event_tapes:
+            simulator.use_tape(self.event_tapes[iteration % len(self.event_tapes)])
+        return iteration + 1
+
+    def search_loop(self, root, simulator, stop=None):
+        '''
+        Runs MCTS iterations on the simulator (in the state of the root) until the time manager stops them,
+        or, if a stop event is given, until it is set. There is nothing to search from the end of the game.
+        '''
+        if simulator.turns_to_go == 0:
+            return
+        root_checkpoint = simulator.checkpoint()
+        time_manager = self.time_manager
+        # In the factored mode the root decides only the first ship, so it can't tell when the choice is settled.
+        decision_root = None if self.factored else root
+        root_statistics = self.child_statistics(simulator)
+        iteration_start = time()
+        iteration = 0
+        while time_manager.keep_searching(decision_root, root_statistics) if stop is None else not stop.is_set():
+            iteration = self.next_tape(simulator, iteration)
+            node, partial_action, path = self.selection(root, simulator)
+            if simulator.turns_to_go == 0:
+                # If we reached the end of the game, we will backpropagate the score and return the best action.
+                self.backpropagation(node, simulator.get_score(), path)
+            else:
+                self.expansion(simulator, node, partial_action)
+                if self.rollout_batch_size:
+                    for simulation_result in self.batched_simulation(node, simulator, partial_action):
+                        self.backpropagation(node, simulation_result, path)
+                else:
+                    played = [] if self.rave else None
+                    simulation_result = self.simulation(node, simulator, partial_action, played)
+                    self.backpropagation(node, simulation_result, path, played or ())
+            if self.thread_pool is not None:
+                self.release_virtual_loss(node)
+            simulator.undo(root_checkpoint)
+            iteration_end = time()
+            time_manager.record_iteration(iteration_end - iteration_start)
+            iteration_start = iteration_end
+
+    def array_search(self, simulator, start_time, time_limit):
+        ''' The search() of the array tree: returns the index of the root in the tree store. '''
+        store = self.tree_store
+        root = self.array_reuse_root(simulator) if self.reuse_tree else None
+        if root is None:
+            root = store.new_root(self.player_number)
+        if self.book is not None:
+            self.array_seed_root(store, root, simulator)
+        if store.child_count[root]:
+            # Stale root actions stay in the block (selection skips them), new ones are added.
+            self.array_expansion(store, root, simulator)
+        self.time_manager.start_turn(start_time, self.is_critical(simulator), time_limit)
+        root_checkpoint = simulator.checkpoint()
+        time_manager = self.time_manager
+        iteration_start = time()
+        selection = self.vectorized_selection if self.vectorized else self.array_selection
+        iteration = 0
+        while time_manager.keep_searching():
+            iteration = self.next_tape(simulator, iteration)
+            node = selection(store, root, simulator)
+            if simulator.turns_to_go == 0:
+                self.array_backpropagation(store, node, simulator.get_score())
+            else:
+                self.array_expansion(store, node, simulator)
+                if self.rollout_batch_size:
+                    for simulation_result in self.batched_rollouts(simulator, store.player[node]):
+                        self.array_backpropagation(store, node, simulation_result)
+                else:
+                    self.array_backpropagation(store, node, self.rollout_engine.run(simulator, store.player[node]))
+            simulator.undo(root_checkpoint)
+            iteration_end = time()
+            time_manager.record_iteration(iteration_end - iteration_start)
+            iteration_start = iteration_end
+        return root
+
+    def array_available_children(self, store, node, simulator):
+        ''' The children of the node (by index) whose actions are legal in the current state of the simulator. '''
+        legal_atomic_actions = set()
+        for ship in self.ships_of(store.player[node]):
+            legal_atomic_actions.update(simulator.legal_atomic_actions(ship))
+        actions, action = store.actions, store.action
+        return [child for child in store.children(node)
+                if all(atomic_action in legal_atomic_actions for atomic_action in actions[action[child]])]
+
+    def array_selection(self, store, root, simulator):
+        ''' selection() on the array tree: returns the index of the selected node. '''
+        visits, sum_score = store.visits, store.sum_score
+        node = root
+        while store.child_count[node]:
+            children = self.array_available_children(store, node, simulator)
+            if not children:
+                break
+            log_visits = 2 * math.log(max(visits[node], 1))
+            max_uct_value = float('-inf')
+            max_uct_children = []
+            for child in children:
+                child_visits = visits[child]
+                if child_visits == 0:
+                    uct_value = float('inf')
+                else:
+                    uct_value = sum_score[child] / child_visits + (log_visits / child_visits) ** 0.5
+                if uct_value > max_uct_value:
+                    max_uct_value = uct_value
+                    max_uct_children = [child]
+                elif uct_value == max_uct_value:
+                    max_uct_children.append(child)
+            child = self.rng.choice(max_uct_children)
+            self.play_turn(simulator, store.action_of(child), store.player[node])
+            node = child
+        return node
+
+    def log_term(self, visits):
+        ''' The cached 2 * log(visits) of the UCT formula. '''
+        log_terms = self.log_terms
+        while len(log_terms) <= visits:
+            log_terms.append(2 * math.log(len(log_terms)))
+        return log_terms[max(visits, 1)]
+
+    def vectorized_selection(self, store, root, simulator):
+        '''
+        array_selection() with the UCT values of all the children of a node computed at once, on NumPy views of the
+        node's block in the tree store. Only the best child is checked for legality; a stale one is masked out and
+        the next best is taken.
+        '''
+        np = self.np
+        node = root
+        while store.child_count[node]:
+            first, count = store.first_child[node], store.child_count[node]
+            # Every view is offset by the item size of its own array.
+            visits = np.frombuffer(store.visits, dtype=np.int64, count=count, offset=first * store.visits.itemsize)
+            sum_score = np.frombuffer(store.sum_score, dtype=np.float64, count=count,
+                                      offset=first * store.sum_score.itemsize)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log_term = self.log_term(store.visits[node])
+                uct_values = np.where(visits > 0, sum_score / visits + np.sqrt(log_term / visits), np.inf)
+            # The views must not outlive the selection, the store can't grow while they exist.
+            del visits, sum_score
+            legal_atomic_actions = set()
+            for ship in self.ships_of(store.player[node]):
+                legal_atomic_actions.update(simulator.legal_atomic_actions(ship))
+            child = None
+            while True:
+                max_uct_value = uct_values.max()
+                if max_uct_value == -np.inf:
+                    break
+                max_uct_children = np.flatnonzero(uct_values == max_uct_value)
+                candidate = first + int(max_uct_children[self.rng.randrange(len(max_uct_children))])
+                if all(atomic_action in legal_atomic_actions for atomic_action in store.action_of(candidate)):
+                    child = candidate
+                    break
+                uct_values[candidate - first] = -np.inf
+            if child is None:
+                break
+            self.play_turn(simulator, store.action_of(child), store.player[node])
+            node = child
+        return node
+
+    def array_expansion(self, store, node, simulator):
+        ''' expansion() on the array tree: adds a child for every legal action that has none yet. '''
+        player_number = store.player[node]
+        existing_actions = {store.action[child] for child in store.children(node)}
+        action_ids = store.action_ids
+        new_actions = [action for action in self.get_legal_actions(simulator, player_number)
+                       if action_ids.get(action) not in existing_actions]
+        store.add_children(node, new_actions, 3 - player_number)
+
+    def array_backpropagation(self, store, node, simulation_result):
+        ''' backpropagation() on the array tree, a node counts wins of the player whose action led to it. '''
+        while node != -1:
+            mover = 3 - store.player[node]
+            store.update(node, simulation_result['player ' + str(mover)] >
+                         simulation_result['player ' + str(3 - mover)])
+            node = store.parent[node]
+
+    def array_reuse_root(self, simulator):
+        ''' reuse_root() on the array tree: compacts the store to the subtree of the reused node, or returns None. '''
+        last_choice, after_last_choice = self.last_choice, self.after_last_choice
+        self.last_choice = self.after_last_choice = None
+        if last_choice is None:
+            return None
+        store = self.tree_store
+        observed = self.state_signature(simulator)
+        reused = None
+        for child in store.children(last_choice):
+            if (self.explains(store.action_of(child), after_last_choice, observed)
+                    and (reused is None or store.visits[child] > store.visits[reused])):
+                reused = child
+        if reused is None:
+            return None
+        return store.compact(reused)
+
+    def array_best_child(self, root, simulator):
+        '''
+        best_child() on the array tree: the action with the best mean score among the legal root children,
+        or a random legal action if there are none.
+        '''
+        store = self.tree_store
+        mean_score = lambda child: store.sum_score[child] / store.visits[child] if store.visits[child] else float("inf")
+        children = self.array_available_children(store, root, simulator)
+        if not children:
+            return self.rng.choice(self.get_legal_actions(simulator, self.player_number)), None
+        child = max(children, key=mean_score)
+        return store.action_of(child), child
+
+    def root_statistics(self, root):
+        ''' Returns the (joint action, visits, sum of scores) of every whole-turn action searched from the root. '''
+        if self.tree_store is not None:
+            store = self.tree_store
+            return [(store.action_of(child), store.visits[child], store.sum_score[child])
+                    for child in store.children(root)]
+        return [(action, node.visits, node.sum_score) for action, node in self.turn_children(root)]
+
+    def book_statistics(self, simulator):
+        '''
+        Returns the book's (joint action, visits, sum of scores) of the state of the simulator, with the visits scaled
+        down to at most book_visits in all, and keeps them as the prior of the current root. Returns [] if the state
+        is not in the book, and after our first book_moves positions.
+        '''
+        self.book_prior = {}
+        if self.book_lookups == self.book_moves:
+            return []
+        self.book_lookups += 1
+        key = OpeningBook.state_key(simulator, self.player_number)
+        statistics = self.book_entries[key] if key in self.book_entries else self.book.get(key)
+        # The prefetched positions are the candidates for the first one only.
+        self.book_entries = {}
+        if not statistics:
+            return []
+        scale = min(1.0, self.book_visits / sum(visits for _, visits, _ in statistics))
+        prior = []
+        for action, visits, sum_score in statistics:
+            scaled_visits = round(visits * scale)
+            if scaled_visits and self.is_legal(action, self.player_number, simulator):
+                prior.append((action, scaled_visits, sum_score * scaled_visits / visits))
+                self.book_prior[action] = (scaled_visits, sum_score * scaled_visits / visits)
+        return prior
+
+    def seed_root(self, root, simulator):
+        ''' Adds the book's statistics of the state of the simulator to the root. '''
+        self.add_root_statistics(root, self.book_statistics(simulator))
+
+    def add_root_statistics(self, root, statistics):
+        '''
+        Adds the (joint action, visits, sum of scores) statistics of legal actions to the root's children of the
+        actions, which are created if the root has none.
+        '''
+        children = {child.action: child for child in root.children}
+        for action, visits, sum_score in statistics:
+            child = children.get(action)
+            if child is None:
+                child = children[action] = self.child_node(root, action)
+                root.children.append(child)
+            child.visits += visits
+            child.sum_score += sum_score
+            root.visits += visits
+
+    def array_seed_root(self, store, root, simulator):
+        ''' seed_root() on the array tree. '''
+        prior = self.book_statistics(simulator)
+        existing = {store.action_of(child) for child in store.children(root)}
+        store.add_children(root, [action for action, _, _ in prior if action not in existing], 3 - self.player_number)
+        children = {store.action_of(child): child for child in store.children(root)}
+        for action, visits, sum_score in prior:
+            child = children[action]
+            store.visits[child] += visits
+            store.sum_score[child] += sum_score
+            store.visits[root] += visits
+
+    def record_book(self, statistics, simulator):
+        '''
+        Records the root statistics of a search of the state of the simulator (without the book's prior) in the book,
+        for our first book_moves searches. At our last turn, they are written by a thread of their own, so act()
+        doesn't wait for the file.
+        '''
+        if self.recorded_moves < self.book_moves:
+            self.recorded_moves += 1
+            searched = []
+            for action, visits, sum_score in statistics:
+                prior_visits, prior_sum_score = self.book_prior.get(action, (0, 0))
+                searched.append((action, visits - prior_visits, sum_score - prior_sum_score))
+            self.book.record(OpeningBook.state_key(simulator, self.player_number), searched)
+        self.book_prior = {}
+        if simulator.turns_to_go <= 2:
+            threading.Thread(target=self.book.flush).start()
+
+    def parallel_act(self, state, start_time):
+        '''
+        Root parallelization: every worker process searches the state with its own seed, and the visits and scores
+        of the root actions are summed over the workers. The action with the best merged mean score is chosen.
+        '''
+        self.time_manager.start_turn(start_time, self.is_critical(Simulator(state)))
+        time_limit = self.time_manager.deadline - start_time
+        futures = [self.pool.submit(_root_search, state, self.rng.getrandbits(64), start_time, time_limit)
+                   for _ in range(self.workers)]
+        merged = {}
+        for future in futures:
+            for action, visits, sum_score in future.result():
+                statistics = merged.setdefault(action, [0, 0])
+                statistics[0] += visits
+                statistics[1] += sum_score
+        if self.book is not None:
+            simulator = Simulator(state)
+            self.record_book([(action, visits, sum_score) for action, (visits, sum_score) in merged.items()], simulator)
+            for action, visits, sum_score in self.book_statistics(simulator):
+                statistics = merged.setdefault(action, [0, 0])
+                statistics[0] += visits
+                statistics[1] += sum_score
+            self.book_prior = {}
+        visited = [(sum_score / visits, action) for action, (visits, sum_score) in merged.items() if visits]
+        if not visited:
+            return self.rng.choice(Simulator(state).legal_actions(self.player_number))
+        return max(visited)[1]
+
+    def start_pondering(self):
+        '''
+        Starts searching the state after our action in the pondering process, until stop_pondering() is called.
+        '''
+        if self.last_choice is None:
+            return
+        simulator = self.after_last_choice.clone(self.rng.getrandbits(64))
+        if self.player_number == 2:
+            # Our action ended the round, the tree below it starts after the collisions and the marines moves.
+            simulator.check_collision_with_marines()
+            simulator.move_marines()
+        # The rival's act() takes at most an action timeout, so a pondering that outlasts two was abandoned.
+        self.ponder_future = self.ponder_pool.submit(_ponder, simulator.game_state, self.rng.getrandbits(64),
+                                                     2 * self.time_manager.action_timeout)
+
+    def stop_pondering(self):
+        ''' Stops the pondering search (after its current iteration) and keeps its statistics for reuse_root(). '''
+        if self.ponder_future is None:
+            return
+        self.ponder_stop.set()
+        self.pondered = self.ponder_future.result()
+        self.ponder_stop.clear()
+        self.ponder_future = None
+
+    def close(self):
+        '''
+        Shuts down the worker processes and threads of the parallel modes and the pondering, and writes the book.
+        '''
+        self.stop_pondering()
+        if self.ponder_pool is not None:
+            self.ponder_pool.shutdown()
+            self.ponder_pool = None
+        if self.book is not None:
+            self.book.flush()
+            self.book.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown()
+            self.thread_pool = None
 
     def act(self, state):
         '''
         The act function is used to run the MCTS algorithm and return the best action to take.
-        We also check the time so we won't exceed the time limit.
+        The time manager decides how long to search, so we won't exceed the time limit.
         In the end we choose the best child node to explore and return the action of this node.
         '''
         start_time = time()
-        root = UCTNode(player_number=self.player_number)
+        self.stop_pondering()
+        # The rollout lengths are counted per turn, rollout_engine.length_distribution() reports the last search.
+        self.rollout_engine.reset_statistics()
+        if self.pool is not None:
+            return self.parallel_act(state, start_time)
+        root, simulator = self.search(state, start_time)
 
-        while time() - start_time < 4.2:
-            node = self.selection(root)
-            if self.simulator.turns_to_go == 0:
-                # If we reached the end of the game, we will backpropagate the score and return the best action.
-                self.backpropagation(node, self.simulator.get_score())
-            else:
-                self.expansion(state, node)
-                simulation_result = self.simulation(node, self.simulator.turns_to_go, Simulator(state))
-                self.backpropagation(node, simulation_result)
+        if self.tree_store is not None:
+            action, child = self.array_best_child(root, simulator)
+        else:
+            action, child = self.best_child(root, simulator)
+        if self.book is not None:
+            self.record_book(self.root_statistics(root), simulator)
+        if self.reuse_tree and child is not None:
+            self.last_choice = child
+            self.after_last_choice = simulator.clone()
+            self.after_last_choice.apply_action(action, self.player_number)
+            # After our last action of the game there is no turn of ours to ponder for.
+            if self.ponder and self.after_last_choice.turns_to_go > 1:
+                self.start_pondering()
+        return action
+
+
+# The agent of a worker process of the root-parallel mode, built once by the pool initializer.
+_worker_agent = None
+
+
+def _start_worker(initial_state, player_number, options):
+    global _worker_agent
+    _worker_agent = UCTAgent(initial_state, player_number, **options)
+
+
+# The event that stops the search of the pondering process, shared with its agent by the pool initializer.
+_ponder_stop = None
+
+
+def _start_ponderer(initial_state, player_number, options, stop):
+    global _ponder_stop
+    _start_worker(initial_state, player_number, options)
+    _ponder_stop = stop
+
+
+def _worker_ready(delay):
+    sleep(delay)
+    return True
+
+
+def _root_search(state, seed, start_time, time_limit):
+    ''' Searches the state in a worker process and returns the statistics of the root actions. '''
+    _worker_agent.rng.seed(seed)
+    root, _ = _worker_agent.search(state, start_time, time_limit)
+    return _worker_agent.root_statistics(root)
 
-        child = max(root.children, key=lambda child: child.sum_score / child.visits if child.visits else float("inf"))  # No exploration
-        return child.action
 
+def _ponder(game_state, seed, time_limit):
+    '''
+    Searches the state after our action (the rival to move) in the pondering process until the stop event is set,
+    or for time_limit seconds (the agent may never act again, when a game is cut short).
+    Returns, for every rival action, its visits and the (joint action, visits, sum of scores) of our actions after it.
+    '''
+    _worker_agent.rng.seed(seed)
+    simulator = Simulator(game_state, _worker_agent.rng.getrandbits(64))
+    root = UCTNode(player_number=3 - _worker_agent.player_number)
+    timer = threading.Timer(time_limit, _ponder_stop.set)
+    timer.start()
+    _worker_agent.search_loop(root, simulator, _ponder_stop)
+    timer.cancel()
+    return {action: (child.visits, [statistics for statistics in _worker_agent.root_statistics(child) if statistics[1]])
+            for action, child in _worker_agent.turn_children(root) if child.visits}
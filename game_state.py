@@ -0,0 +1,84 @@
+"""
+A compact representation of the pirates game state.
+The Simulator runs on it natively; the nested dict format handed to the agents is produced
+and consumed only at the edges, through GameState.from_dict() and GameState.to_dict().
+"""
+
+
+class GameState:
+    """
+    A slotted game state.
+    The static parts of the game (map, base, ship names and owners, marine names and paths) are
+    shared between copies, while the dynamic parts live in flat lists and a single dict, so that
+    copy() never has to walk a nested structure.
+    Ships and marines are addressed by their index in ship_names / marine_names,
+    and treasures map a name to a (location, reward) tuple, where location is either a cell
+    or the name of the ship holding the treasure.
+    """
+    __slots__ = ('map', 'base', 'ship_names', 'ship_players', 'ship_index', 'marine_names', 'marine_paths',
+                 'ship_locations', 'ship_capacities', 'treasures', 'marine_indices', 'turns_to_go')
+
+    @classmethod
+    def from_dict(cls, state):
+        """ Builds a compact state from the nested dict format used by main.py and the agents. """
+        game_state = cls.__new__(cls)
+        game_state.map = tuple(tuple(row) for row in state['map'])
+        game_state.base = tuple(state['base'])
+        game_state.ship_names = tuple(state['pirate_ships'].keys())
+        game_state.ship_players = tuple(ship['player'] for ship in state['pirate_ships'].values())
+        game_state.ship_index = {name: i for i, name in enumerate(game_state.ship_names)}
+        game_state.marine_names = tuple(state['marine_ships'].keys())
+        game_state.marine_paths = tuple(tuple(tuple(cell) for cell in marine['path'])
+                                        for marine in state['marine_ships'].values())
+        game_state.ship_locations = [tuple(ship['location']) for ship in state['pirate_ships'].values()]
+        game_state.ship_capacities = [ship['capacity'] for ship in state['pirate_ships'].values()]
+        game_state.treasures = {}
+        for name, treasure in state['treasures'].items():
+            location = treasure['location']
+            if type(location) != str:
+                location = tuple(location)
+            game_state.treasures[name] = (location, treasure['reward'])
+        game_state.marine_indices = [marine['index'] for marine in state['marine_ships'].values()]
+        game_state.turns_to_go = state['turns to go']
+        return game_state
+
+    def to_dict(self):
+        """ Returns a fresh nested dict in the format used by main.py and the agents. """
+        return {
+            'map': [list(row) for row in self.map],
+            'base': self.base,
+            'pirate_ships': {name: {'location': self.ship_locations[i],
+                                    'capacity': self.ship_capacities[i],
+                                    'player': self.ship_players[i]}
+                             for i, name in enumerate(self.ship_names)},
+            'treasures': {name: {'location': location, 'reward': reward}
+                          for name, (location, reward) in self.treasures.items()},
+            'marine_ships': {name: {'index': self.marine_indices[i], 'path': list(self.marine_paths[i])}
+                             for i, name in enumerate(self.marine_names)},
+            'turns to go': self.turns_to_go
+        }
+
+    def copy(self):
+        """ Returns an independent copy. Only the dynamic lists and the treasures dict are duplicated. """
+        game_state = GameState.__new__(GameState)
+        game_state.map = self.map
+        game_state.base = self.base
+        game_state.ship_names = self.ship_names
+        game_state.ship_players = self.ship_players
+        game_state.ship_index = self.ship_index
+        game_state.marine_names = self.marine_names
+        game_state.marine_paths = self.marine_paths
+        game_state.ship_locations = self.ship_locations[:]
+        game_state.ship_capacities = self.ship_capacities[:]
+        game_state.treasures = self.treasures.copy()
+        game_state.marine_indices = self.marine_indices[:]
+        game_state.turns_to_go = self.turns_to_go
+        return game_state
+
+    def marine_locations(self):
+        """ Returns the current cell of every marine ship. """
+        return [path[index] for path, index in zip(self.marine_paths, self.marine_indices)]
+
+    def ships_of(self, player):
+        """ Returns the names of the ships that belong to the given player. """
+        return [name for name, owner in zip(self.ship_names, self.ship_players) if owner == player]
@@ -0,0 +1,97 @@
+"""
+Forecasts of where the marine ships will be.
+A marine walks its path as in Simulator.move_marines(): from index i it moves uniformly to one of i-1, i and i+1 that
+lie inside the path, so its index is a Markov chain whose transitions depend only on the length of the path.
+The distributions of all the starting indices of a marine are the rows of the powers of its transition matrix,
+computed with NumPy.
+"""
+
+import numpy as np
+
+
+def transition_matrix(path_length):
+    """ Returns the transition matrix (an array, row i is the distribution of the next index from i) of a path. """
+    indices = np.arange(path_length)
+    moves = np.zeros((path_length, path_length))
+    for step in (-1, 0, 1):
+        targets = indices + step
+        inside = (targets >= 0) & (targets < path_length)
+        moves[indices[inside], targets[inside]] = 1.0
+    return moves / moves.sum(axis=1, keepdims=True)
+
+
+class MarineForecast:
+    """
+    Precomputed occupancy probabilities of the marines.
+    For every marine, turns ahead (number of move_marines() calls) and current index, the distribution over the
+    cells of its path is computed once, and risk maps of the whole fleet are cached by (indices, turns),
+    so reading the collision risk of a cell is a dict lookup.
+    """
+    def __init__(self, marine_names, marine_paths, horizon=10):
+        self.marine_names = tuple(marine_names)
+        self.marine_paths = tuple(tuple(tuple(cell) for cell in path) for path in marine_paths)
+        self.matrices = [transition_matrix(len(path)) for path in self.marine_paths]
+        # _index_distributions[marine][turns] - the matrix power: row i is the distribution over path indices
+        # after that many turns from index i.
+        self._index_distributions = [[np.eye(len(path))] for path in self.marine_paths]
+        # _cells[marine], _projections[marine] - the distinct cells of the path, and the matrix that sums the
+        # probabilities of the path indices into them (a path may pass through a cell more than once).
+        self._cells = []
+        self._projections = []
+        for path in self.marine_paths:
+            cells = list(dict.fromkeys(path))
+            projection = np.zeros((len(path), len(cells)))
+            projection[np.arange(len(path)), [cells.index(cell) for cell in path]] = 1.0
+            self._cells.append(cells)
+            self._projections.append(projection)
+        self._occupancies = [[] for _ in self.marine_paths]
+        self._risk_maps = {}
+        for marine in range(len(self.marine_paths)):
+            self._extend(marine, horizon)
+
+    @classmethod
+    def from_state(cls, state, horizon=10):
+        """ Builds the forecast of the marines of a state dict. """
+        return cls(state['marine_ships'].keys(), [marine['path'] for marine in state['marine_ships'].values()],
+                   horizon)
+
+    def _extend(self, marine, turns):
+        """ Computes the distributions of a marine up to the given number of turns ahead. """
+        distributions = self._index_distributions[marine]
+        matrix = self.matrices[marine]
+        while len(distributions) <= turns:
+            distributions.append(distributions[-1] @ matrix)
+        occupancies = self._occupancies[marine]
+        cells = self._cells[marine]
+        while len(occupancies) <= turns:
+            by_cell = distributions[len(occupancies)] @ self._projections[marine]
+            occupancies.append([{cells[j]: float(row[j]) for j in np.flatnonzero(row > 0)} for row in by_cell])
+
+    def occupancy(self, marine, index, turns):
+        """ Returns a dict from a cell to the probability that the marine (by number) is there after turns moves. """
+        if turns >= len(self._occupancies[marine]):
+            self._extend(marine, turns)
+        return self._occupancies[marine][turns][index]
+
+    def risk_map(self, marine_indices, turns=0):
+        """
+        Returns a dict from a cell to the probability that at least one marine is there after turns moves,
+        given the current indices of the marines (in the order of marine_names). Cells missing from it are safe.
+        """
+        key = (tuple(marine_indices), turns)
+        risk_map = self._risk_maps.get(key)
+        if risk_map is None:
+            safe = {}
+            for marine, index in enumerate(marine_indices):
+                for cell, probability in self.occupancy(marine, index, turns).items():
+                    safe[cell] = safe.get(cell, 1.0) * (1 - probability)
+            risk_map = self._risk_maps[key] = {cell: 1 - probability for cell, probability in safe.items()}
+        return risk_map
+
+    def risk(self, cell, marine_indices, turns=0):
+        """ The probability that at least one marine is in the cell after turns moves. """
+        return self.risk_map(marine_indices, turns).get(cell, 0.0)
+
+    def indices(self, state):
+        """ The current marine indices of a state dict, in the order of marine_names. """
+        return [state['marine_ships'][name]['index'] for name in self.marine_names]
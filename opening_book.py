@@ -0,0 +1,212 @@
+"""
+A persistent, memory-mapped store of root statistics of the UCT search.
+Games often start from the same maps, so the searches of their early positions are worth keeping between runs:
+UCTAgent looks a position up by its state key and starts its search from the stored statistics, and writes the
+statistics of its own searches back at the end of the game.
+Run this module to compact a book (python opening_book.py BOOK).
+"""
+
+import argparse
+import ast
+import mmap
+import os
+import struct
+import threading
+
+from simulator import zobrist_key
+
+
+class OpeningBook:
+    """
+    The book file is:
+        - a header: the magic bytes and the number of positions.
+        - an index: a (key, offset, length) record per position, sorted by key, so a lookup is a binary search
+          in the memory-mapped file.
+        - the statistics of the positions, each the repr of a list of (joint action, visits, sum of scores).
+    Statistics recorded during a run are kept in memory until flush() appends them to a log next to the book
+    (path + '.log'), a line per position, so writing them costs only their own size. Opening the book reads only the
+    keys of the log's lines, a position's lines are parsed by its first get(), which merges their statistics with the
+    book's (summing the visits and scores of the same actions).
+    compact() merges the log into the book file, which it rewrites and replaces atomically. It reads the whole book,
+    so it is meant to run offline, between games, rather than while an agent is on the clock.
+    """
+    MAGIC = b'UCTBOOK1'
+    HEADER = struct.Struct('<8sQ')
+    RECORD = struct.Struct('<QQQ')
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = path + '.log'
+        self.map = None
+        self.count = 0
+        self.updates = {}
+        self.lock = threading.Lock()
+        self._open()
+        # log_lines[key] - the offsets of the log lines of the position, until they are parsed into logged[key]:
+        # the statistics of the position in the log, merged.
+        self.log_lines = self._index_log()
+        self.logged = {}
+
+    @staticmethod
+    def state_key(simulator, player_number):
+        """
+        The canonical key of a position: the simulator's Zobrist hash (which is the same in every process),
+        combined with the map, the score and the player to move.
+        """
+        game_state = simulator.game_state
+        return (simulator.hash ^ zobrist_key(('map', game_state.map))
+                ^ zobrist_key(('score', simulator.score['player 1'], simulator.score['player 2']))
+                ^ zobrist_key(('player', player_number)))
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb') as book_file:
+            self.map = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not an opening book!")
+
+    def _index_log(self):
+        """ Returns the offsets of the log lines of every position, only the key at the start of a line is parsed. """
+        log_lines = {}
+        if not os.path.exists(self.log_path):
+            return log_lines
+        offset = 0
+        with open(self.log_path, 'rb') as log_file:
+            for line in log_file:
+                try:
+                    key = int(line[1:line.index(b',')])
+                except ValueError:
+                    # A line cut short by a write that didn't finish (the next line may have been appended to it).
+                    pass
+                else:
+                    log_lines.setdefault(key, []).append(offset)
+                offset += len(line)
+        return log_lines
+
+    def _logged(self, key):
+        """ The statistics of the position in the log, or None. Its lines are parsed on the first call. """
+        offsets = self.log_lines.pop(key, None)
+        if offsets is not None:
+            statistics = self.logged.get(key, ())
+            with open(self.log_path, 'rb') as log_file:
+                for offset in offsets:
+                    log_file.seek(offset)
+                    try:
+                        _, line_statistics = ast.literal_eval(log_file.readline().decode())
+                    except (SyntaxError, ValueError):
+                        continue
+                    statistics = self.merge(statistics, line_statistics)
+            self.logged[key] = statistics
+        return self.logged.get(key)
+
+    def _record(self, index):
+        return self.RECORD.unpack_from(self.map, self.HEADER.size + index * self.RECORD.size)
+
+    def _statistics(self, offset, length):
+        start = self.HEADER.size + self.count * self.RECORD.size + offset
+        return ast.literal_eval(self.map[start:start + length].decode())
+
+    def get(self, key):
+        """ Returns the stored list of (joint action, visits, sum of scores) of the position, or None. """
+        statistics = self._book_statistics(key)
+        with self.lock:
+            logged = self._logged(key)
+        if logged is None:
+            return statistics
+        return logged if statistics is None else self.merge(statistics, logged)
+
+    def _book_statistics(self, key):
+        """ The statistics of the position in the book file (a binary search of its index), or None. """
+        if self.map is None:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, offset, length = self._record(middle)
+            if record_key == key:
+                return self._statistics(offset, length)
+            if record_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def record(self, key, statistics):
+        """ Adds the statistics of a search of the position, to be written by flush(). """
+        with self.lock:
+            self.updates[key] = self.merge(self.updates.get(key, ()), statistics)
+
+    @staticmethod
+    def merge(statistics, other_statistics):
+        merged = {}
+        for action, visits, sum_score in list(statistics) + list(other_statistics):
+            if not visits:
+                continue
+            totals = merged.setdefault(action, [0, 0])
+            totals[0] += visits
+            totals[1] += sum_score
+        return [(action, visits, sum_score) for action, (visits, sum_score) in merged.items()]
+
+    def flush(self):
+        """ Appends the recorded statistics to the log. """
+        with self.lock:
+            updates, self.updates = self.updates, {}
+            if not updates:
+                return
+            with open(self.log_path, 'a') as log_file:
+                log_file.write(''.join(f"{(key, statistics)!r}\n" for key, statistics in updates.items()))
+            for key, statistics in updates.items():
+                self.logged[key] = self.merge(self._logged(key) or (), statistics)
+
+    def compact(self):
+        """ Merges the log (and the recorded statistics) into the book file, and removes the log. """
+        self.flush()
+        for key in list(self.log_lines):
+            self._logged(key)
+        positions = {}
+        for index in range(self.count):
+            key, offset, length = self._record(index)
+            positions[key] = self._statistics(offset, length)
+        for key, statistics in self.logged.items():
+            positions[key] = self.merge(positions.get(key, ()), statistics)
+        index, blobs, offset = [], [], 0
+        for key in sorted(positions):
+            blob = repr(positions[key]).encode()
+            index.append(self.RECORD.pack(key, offset, len(blob)))
+            blobs.append(blob)
+            offset += len(blob)
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as book_file:
+            book_file.write(self.HEADER.pack(self.MAGIC, len(positions)))
+            book_file.write(b''.join(index))
+            book_file.write(b''.join(blobs))
+        self.close()
+        os.replace(temporary_path, self.path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.logged = {}
+        self._open()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.count = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merges the log of an opening book into the book file.")
+    parser.add_argument('path', help="the book file")
+    args = parser.parse_args()
+    book = OpeningBook(args.path)
+    logged = len(book.log_lines.keys() | book.logged.keys())
+    book.compact()
+    print(f"Merged {logged} logged positions, the book has {book.count} positions.")
+    book.close()
+
+
+if __name__ == '__main__':
+    main()
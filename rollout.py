@@ -0,0 +1,135 @@
+"""
+The rollout (default policy) phase of MCTS.
+A rollout plays a Simulator in place from the state below the expansion frontier to the end of the game
+(or to a horizon, where a heuristic evaluator scores the state), without adding nodes to the search tree,
+and returns the final score.
+"""
+
+from utils import histogram
+
+
+def uniform_policy(simulator, player_number, rng):
+    """ The default policy: a uniformly random legal joint action of the player. """
+    return rng.choice(simulator.legal_actions(player_number))
+
+
+class GreedyPolicy:
+    """
+    A playout policy that plays as a greedy agent (exp3's Agent), ship by ship: the agent's preferred_action
+    (deposit, collect or plunder) among the ship's legal actions, and otherwise a sail towards the agent's
+    sail_target(ship, state), or a wait if a marine may be there (by the agent's marine_forecast).
+    agent_class(initial_state, player_number) builds the agent, the targets don't depend on its player.
+    The sail target needs the state dict and a search over the treasures, so it is cached by what it depends on:
+    the ship's cell, whether it holds treasures (a loaded ship goes to the base), and if not, the treasures on the map
+    (by the simulator's map_treasures_key).
+    The cache is emptied when it holds max_cached targets.
+    """
+    def __init__(self, initial_state, agent_class, max_cached=100000):
+        self.agent = agent_class(initial_state, 1)
+        self.preferred_action = agent_class.preferred_action
+        self.max_cached = max_cached
+        self.cache = {}
+
+    def __call__(self, simulator, player_number, rng):
+        game_state = simulator.game_state
+        action = []
+        risk_map = None
+        for ship, atomic_actions in simulator.legal_actions_by_ship(player_number).items():
+            chosen = self.preferred_action(atomic_actions, game_state)
+            if chosen is None:
+                sail_to = self.sail_target(simulator, ship)
+                if sail_to is None:
+                    chosen = rng.choice(atomic_actions)
+                else:
+                    if risk_map is None:
+                        risk_map = self.agent.marine_forecast.risk_map(game_state.marine_indices)
+                    chosen = ('wait', ship) if risk_map.get(sail_to, 0) > 0 else ('sail', ship, sail_to)
+            action.append(chosen)
+        return tuple(action)
+
+    def sail_target(self, simulator, ship):
+        """ Returns the (cached) sail target of the agent, or None if it has none (no treasure to go to). """
+        game_state = simulator.game_state
+        index = game_state.ship_index[ship]
+        location = game_state.ship_locations[index]
+        loaded = game_state.ship_capacities[index] < 2
+        key = (location, None if loaded else simulator.map_treasures_key)
+        sail_to = self.cache.get(key, False)
+        if sail_to is not False:
+            return sail_to
+        # Only the parts of the state dict that sail_target reads.
+        state = {'base': game_state.base,
+                 'pirate_ships': {ship: {'location': location, 'capacity': game_state.ship_capacities[index]}},
+                 'treasures': {} if loaded else {name: {'location': cell, 'reward': reward}
+                                                 for name, (cell, reward) in game_state.treasures.items()}}
+        try:
+            sail_to = self.agent.sail_target(ship, state)
+        except ValueError:
+            # The agent has no treasure to sail to.
+            sail_to = None
+        if len(self.cache) >= self.max_cached:
+            self.cache.clear()
+        self.cache[key] = sail_to
+        return sail_to
+
+
+class EpsilonGreedyPolicy:
+    """ Plays a uniformly random action with probability epsilon, and the action of the given policy otherwise. """
+    def __init__(self, policy, epsilon=0.1):
+        self.policy = policy
+        self.epsilon = epsilon
+
+    def __call__(self, simulator, player_number, rng):
+        if rng.random() < self.epsilon:
+            return uniform_policy(simulator, player_number, rng)
+        return self.policy(simulator, player_number, rng)
+
+
+class RolloutEngine:
+    """
+    Plays rollouts in a loop (one iteration per turn, so a game of any length costs no recursion).
+    The policy is any function (simulator, player_number, rng) -> joint action, where the action must be legal,
+    since it is applied with act(..., trusted=True).
+    The rounds are played as in main.py: after player 2 acts, marine collisions are checked and the marines move.
+    The number of turns played by every rollout is counted, to show the cost of an iteration.
+    Given a horizon and an evaluator (such as evaluation.LeafEvaluator), a rollout stops after horizon turns
+    and returns the evaluator's estimate of the final score instead.
+    """
+    def __init__(self, policy=uniform_policy, rng=None, horizon=None, evaluator=None):
+        self.policy = policy
+        self.rng = rng
+        self.horizon = horizon if evaluator is not None else None
+        self.evaluator = evaluator
+        # lengths - the turns played by each rollout so far.
+        self.lengths = []
+
+    def run(self, simulator, player_number, played=None):
+        """
+        Plays the simulator to the end of the game (or the horizon), starting with the given player,
+        and returns the final (or estimated) score.
+        If a played list is given, the (player_number, joint action) of every turn is appended to it.
+        """
+        policy, rng = self.policy, self.rng
+        last_turn = simulator.turns_to_go if self.horizon is None else min(self.horizon, simulator.turns_to_go)
+        turns = 0
+        while turns < last_turn:
+            action = policy(simulator, player_number, rng)
+            if played is not None:
+                played.append((player_number, action))
+            simulator.act(action, player_number, trusted=True)
+            if player_number == 2:
+                simulator.check_collision_with_marines()
+                simulator.move_marines()
+            player_number = 3 - player_number
+            turns += 1
+        self.lengths.append(turns)
+        if simulator.turns_to_go > 0:
+            return self.evaluator.evaluate(simulator)
+        return simulator.get_score()
+
+    def length_distribution(self):
+        """ Returns the (turns, count) pairs of the rollouts played so far, sorted by turns. """
+        return histogram(self.lengths)
+
+    def reset_statistics(self):
+        self.lengths = []
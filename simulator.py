@@ -1,39 +1,362 @@
-from copy import deepcopy
 import logging
 import random
+from itertools import product
+from game_state import GameState
 
 
 TREASURE_ARRIVAL_PROBABILITY = 0.3
 TREASURE_NAMES = ["treasure_1", "treasure_2","treasure_3","treasure_4","treasure_5","treasure_6","treasure_7",
                   "treasure_8","treasure_9","treasure_10","treasure_11","treasure_12","treasure_13","treasure_14"]
 
+def spawn_rng(rng):
+    """ Returns a new random.Random stream, seeded from the given one and independent of it from then on. """
+    return random.Random(rng.getrandbits(64))
+
+
+# Zobrist keys of state features, see zobrist_key().
+_ZOBRIST_KEYS = {}
+
+
+def zobrist_key(feature):
+    """
+    Returns the 64-bit random key of a state feature - a tuple such as ('ship', name, location).
+    A key is derived from the feature itself, so it is the same in every process and in every run.
+    """
+    key = _ZOBRIST_KEYS.get(feature)
+    if key is None:
+        key = _ZOBRIST_KEYS[feature] = random.Random(repr(feature)).getrandbits(64)
+    return key
+
+
+def zobrist_hash(game_state):
+    """
+    Computes the Zobrist hash of a GameState from scratch: the xor of the keys of
+    the ship locations and capacities, the treasures (location or holder, and reward),
+    the marine indices and the turns to go.
+    """
+    state_hash = zobrist_key(('turns', game_state.turns_to_go))
+    for ship, name in enumerate(game_state.ship_names):
+        state_hash ^= zobrist_key(('ship', name, game_state.ship_locations[ship]))
+        state_hash ^= zobrist_key(('capacity', name, game_state.ship_capacities[ship]))
+    for name, treasure in game_state.treasures.items():
+        state_hash ^= zobrist_key(('treasure', name) + treasure)
+    for marine, name in enumerate(game_state.marine_names):
+        state_hash ^= zobrist_key(('marine', name, game_state.marine_indices[marine]))
+    return state_hash
+
+
+def _map_treasure_key(treasure):
+    """ The key of a treasure, by its cell and reward, in Simulator.map_treasures_key (0 if a ship holds it). """
+    location, reward = treasure
+    return zobrist_key(('map treasure', location, reward)) if isinstance(location, tuple) else 0
+
+
+def _index_add(index, key, item):
+    """ Adds an item under a key of an occupancy index (a dict from a key to a tuple of items). """
+    index[key] = index.get(key, ()) + (item,)
+
+
+def _index_remove(index, key, item):
+    """ Removes an item from under a key of an occupancy index. """
+    items = tuple(other for other in index[key] if other != item)
+    if items:
+        index[key] = items
+    else:
+        del index[key]
+
+
+# Kinds of entries in the undo journal of a Simulator.
+_SHIP_LOCATION, _SHIP_CAPACITY, _TREASURE, _MARINE_INDEX, _SCORE, _TURNS_TO_GO, _TAPE_CURSOR = range(7)
+
+# Adjacency tables, keyed by the contents of the map (a tuple of row tuples).
+_ADJACENCY_TABLES = {}
+
+
+def adjacency_table(game_map):
+    """
+    Returns a dict from every cell of the map to a tuple of its sea neighbors (any cell that is not an island).
+    The table is computed once per map contents and shared by every Simulator built from that map.
+    """
+    key = tuple(tuple(row) for row in game_map)
+    table = _ADJACENCY_TABLES.get(key)
+    if table is None:
+        rows, columns = len(key), len(key[0])
+        table = {}
+        for x in range(rows):
+            for y in range(columns):
+                table[(x, y)] = tuple((n_x, n_y) for n_x, n_y in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1))
+                                      if 0 <= n_x < rows and 0 <= n_y < columns and key[n_x][n_y] != 'I')
+        _ADJACENCY_TABLES[key] = table
+    return table
+
+
+# Island cells (where treasures arrive), keyed by the contents of the map.
+_ISLAND_CELLS = {}
+
+
+def island_cells(game_map):
+    """ Returns a tuple of the island cells of the map, computed once per map contents. """
+    key = tuple(tuple(row) for row in game_map)
+    cells = _ISLAND_CELLS.get(key)
+    if cells is None:
+        cells = _ISLAND_CELLS[key] = tuple((x, y) for x, row in enumerate(key) for y, cell in enumerate(row)
+                                           if cell == 'I')
+    return cells
+
+
 class Simulator:
     """
     This the simulator class. You may use it for your agent.
     The functions that may interest you are neighbors(), act()
     move_marines() and check_collision_with_marines()
     """
-    def __init__(self, initial_state):
-        self.state = deepcopy(initial_state)
+    def __init__(self, initial_state, seed=None):
+        # The simulator runs on a compact GameState; initial_state may be either one or a state dict.
+        # All its random events are drawn from its own generator, seeded with seed (or from the OS when it is None).
+        self.rng = random.Random(seed)
+        if isinstance(initial_state, GameState):
+            self.game_state = initial_state.copy()
+        else:
+            self.game_state = GameState.from_dict(initial_state)
         self.score = {'player 1': 0, 'player 2': 0}
-        self.dimensions = len(self.state['map']), len(self.state['map'][0])
-        self.turns_to_go = self.state['turns to go']
-        self.base_location = self.state['base']
+        self.dimensions = len(self.game_state.map), len(self.game_state.map[0])
+        self.base_location = self.game_state.base
+        self.adjacency = adjacency_table(self.game_state.map)
+        self.island_cells = island_cells(self.game_state.map)
         self.MARINE_COLLISION_PENALTY = 1
+        # An optional EventTape of pre-drawn random events, and how many act() and move_marines() draws were used.
+        self.tape = None
+        self.tape_cursor = [0, 0]
+        # Undo journal, only recorded after checkpoint() was called.
+        self.journal = None
+        # Zobrist hash of the game state, kept up to date by the setters below.
+        self.hash = zobrist_hash(self.game_state)
+        self._build_indexes()
+
+    def _build_indexes(self):
+        """
+        Builds the occupancy indexes, kept up to date by the setters below:
+            - ships_at: a cell -> the indices of the ships in it.
+            - marines_at: a cell -> the indices of the marines in it.
+            - treasures_at: a location (a cell, or the name of a holding ship) -> the names of the treasures there.
+        Their values are tuples, so a flat copy of the dicts is an independent copy.
+        Also map_treasures_key, a key of the (cell, reward) of the treasures on the map: the sum of their keys,
+        so two treasures alike don't cancel out as they would in a xor.
+        """
+        game_state = self.game_state
+        self.ships_at, self.marines_at, self.treasures_at = {}, {}, {}
+        for ship, location in enumerate(game_state.ship_locations):
+            _index_add(self.ships_at, location, ship)
+        for marine, location in enumerate(game_state.marine_locations()):
+            _index_add(self.marines_at, location, marine)
+        self.map_treasures_key = 0
+        for treasure_name, treasure in game_state.treasures.items():
+            _index_add(self.treasures_at, treasure[0], treasure_name)
+            self.map_treasures_key += _map_treasure_key(treasure)
+
+    @property
+    def state(self):
+        """ The current state in the dict format. This is a fresh dict, changing it does not affect the simulator. """
+        return self.game_state.to_dict()
+
+    @state.setter
+    def state(self, state):
+        self.set_state(state)
+
+    @property
+    def turns_to_go(self):
+        return self.game_state.turns_to_go
+
+    @turns_to_go.setter
+    def turns_to_go(self, turns_to_go):
+        self._set_turns_to_go(turns_to_go)
+
+    def clone(self, seed=None):
+        """
+        Returns an independent copy of the simulator.
+        This is a flat copy of the compact state, much cheaper than building a new Simulator from a dict.
+        The copy draws from a generator seeded with seed, or from a child stream of this simulator's generator.
+        Clones made with the same seed see the same random events (common random numbers).
+        """
+        simulator = Simulator.__new__(Simulator)
+        simulator.__dict__.update(self.__dict__)
+        simulator.rng = spawn_rng(self.rng) if seed is None else random.Random(seed)
+        simulator.game_state = self.game_state.copy()
+        simulator.score = self.score.copy()
+        simulator.ships_at = self.ships_at.copy()
+        simulator.marines_at = self.marines_at.copy()
+        simulator.treasures_at = self.treasures_at.copy()
+        simulator.tape_cursor = self.tape_cursor[:]
+        simulator.journal = None
+        return simulator
+
+    def checkpoint(self):
+        """
+        Starts recording changes in the undo journal (if not recording already),
+        and returns a mark that undo() can later revert the simulator to.
+        """
+        if self.journal is None:
+            self.journal = []
+        return len(self.journal)
+
+    def undo(self, checkpoint):
+        """
+        Reverts every change made since the given checkpoint, in place.
+        This covers apply_action(), check_collision_with_marines(), move_marines() and add_treasure(),
+        but not the state of the random number generator.
+        """
+        journal, self.journal = self.journal, None
+        try:
+            while len(journal) > checkpoint:
+                kind, key, value = journal.pop()
+                if kind == _SHIP_LOCATION:
+                    self._set_ship_location(key, value)
+                elif kind == _SHIP_CAPACITY:
+                    self._set_ship_capacity(key, value)
+                elif kind == _TREASURE:
+                    self._set_treasure(key, value)
+                elif kind == _MARINE_INDEX:
+                    self._set_marine_index(key, value)
+                elif kind == _SCORE:
+                    self._set_score(key, value)
+                elif kind == _TURNS_TO_GO:
+                    self._set_turns_to_go(value)
+                else:
+                    self._set_tape_cursor(key, value)
+        finally:
+            self.journal = journal
+
+    # All the changes to the game state and the score go through the setters below,
+    # so they can be journaled and the Zobrist hash can be updated incrementally.
+    def _set_ship_location(self, ship, location):
+        game_state = self.game_state
+        old_location = game_state.ship_locations[ship]
+        if self.journal is not None:
+            self.journal.append((_SHIP_LOCATION, ship, old_location))
+        name = game_state.ship_names[ship]
+        self.hash ^= zobrist_key(('ship', name, old_location)) ^ zobrist_key(('ship', name, location))
+        _index_remove(self.ships_at, old_location, ship)
+        _index_add(self.ships_at, location, ship)
+        game_state.ship_locations[ship] = location
+
+    def _set_ship_capacity(self, ship, capacity):
+        game_state = self.game_state
+        old_capacity = game_state.ship_capacities[ship]
+        if self.journal is not None:
+            self.journal.append((_SHIP_CAPACITY, ship, old_capacity))
+        name = game_state.ship_names[ship]
+        self.hash ^= zobrist_key(('capacity', name, old_capacity)) ^ zobrist_key(('capacity', name, capacity))
+        game_state.ship_capacities[ship] = capacity
+
+    def _set_treasure(self, treasure_name, treasure):
+        """ Sets the (location, reward) of a treasure, a treasure of None removes it. """
+        treasures = self.game_state.treasures
+        old_treasure = treasures.get(treasure_name)
+        if self.journal is not None:
+            self.journal.append((_TREASURE, treasure_name, old_treasure))
+        if old_treasure is not None:
+            self.hash ^= zobrist_key(('treasure', treasure_name) + old_treasure)
+            _index_remove(self.treasures_at, old_treasure[0], treasure_name)
+            self.map_treasures_key -= _map_treasure_key(old_treasure)
+        if treasure is None:
+            del treasures[treasure_name]
+        else:
+            self.hash ^= zobrist_key(('treasure', treasure_name) + treasure)
+            _index_add(self.treasures_at, treasure[0], treasure_name)
+            self.map_treasures_key += _map_treasure_key(treasure)
+            treasures[treasure_name] = treasure
+
+    def _set_marine_index(self, marine, index):
+        game_state = self.game_state
+        old_index = game_state.marine_indices[marine]
+        if self.journal is not None:
+            self.journal.append((_MARINE_INDEX, marine, old_index))
+        name = game_state.marine_names[marine]
+        self.hash ^= zobrist_key(('marine', name, old_index)) ^ zobrist_key(('marine', name, index))
+        path = game_state.marine_paths[marine]
+        _index_remove(self.marines_at, path[old_index], marine)
+        _index_add(self.marines_at, path[index], marine)
+        game_state.marine_indices[marine] = index
+
+    def _set_score(self, player_key, score):
+        if self.journal is not None:
+            self.journal.append((_SCORE, player_key, self.score[player_key]))
+        self.score[player_key] = score
+
+    def _set_turns_to_go(self, turns_to_go):
+        old_turns_to_go = self.game_state.turns_to_go
+        if self.journal is not None:
+            self.journal.append((_TURNS_TO_GO, None, old_turns_to_go))
+        self.hash ^= zobrist_key(('turns', old_turns_to_go)) ^ zobrist_key(('turns', turns_to_go))
+        self.game_state.turns_to_go = turns_to_go
+
+    def _set_tape_cursor(self, which, position):
+        if self.journal is not None:
+            self.journal.append((_TAPE_CURSOR, which, self.tape_cursor[which]))
+        self.tape_cursor[which] = position
+
+    def use_tape(self, tape):
+        """
+        Attaches an EventTape (or None to detach it): from now on, add_treasure() and move_marines() consume its draws
+        instead of the random generator, until it runs out. Clones share the tape and keep their own position in it.
+        """
+        self.tape = tape
+        self._set_tape_cursor(0, 0)
+        self._set_tape_cursor(1, 0)
 
     def neighbors(self, location):
         """
-        return the neighbors of a location
+        return the neighbors of a location, as a tuple taken from the shared adjacency table.
+        a location that is not a cell of the map (e.g. a ship name holding a treasure) has no neighbors.
+        """
+        return self.adjacency.get(location, ())
+
+    def legal_atomic_actions(self, pirate_name, offered_treasures=None):
+        """
+        Returns a tuple of every legal atomic action of the given pirate ship.
+        If offered_treasures (a set) is given, treasures in it are not offered for collecting,
+        and the treasures this ship can collect are added to it.
+        """
+        game_state = self.game_state
+        ship = game_state.ship_index[pirate_name]
+        player = game_state.ship_players[ship]
+        location = game_state.ship_locations[ship]
+        actions = [('sail', pirate_name, neighbor) for neighbor in self.neighbors(location)]
+        if game_state.ship_capacities[ship] > 0:
+            # A ship can collect the treasures in the four cells around it (treasures lie on islands).
+            x, y = location
+            for cell in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                for treasure_name in self.treasures_at.get(cell, ()):
+                    if offered_treasures is None:
+                        actions.append(('collect', pirate_name, treasure_name))
+                    elif treasure_name not in offered_treasures:
+                        actions.append(('collect', pirate_name, treasure_name))
+                        offered_treasures.add(treasure_name)
+        if location == self.base_location:
+            for treasure_name in self.treasures_at.get(pirate_name, ()):
+                actions.append(('deposit', pirate_name, treasure_name))
+        for other_ship in self.ships_at[location]:
+            if game_state.ship_players[other_ship] != player:
+                actions.append(('plunder', pirate_name, game_state.ship_names[other_ship]))
+        actions.append(('wait', pirate_name))
+        return tuple(actions)
+
+    def legal_actions_by_ship(self, player):
+        """
+        Returns a dict from each ship of the player to a tuple of its legal atomic actions.
+        The collect action of a treasure is offered only to the first ship that can collect it,
+        so any combination of one action per ship is a legal joint action.
+        """
+        offered_treasures = set()
+        return {pirate_name: self.legal_atomic_actions(pirate_name, offered_treasures)
+                for pirate_name in self.game_state.ships_of(player)}
+
+    def legal_actions(self, player):
+        """
+        Returns a list of legal joint actions of the player - all the combinations of legal_actions_by_ship().
+        These can be passed to act() with trusted=True.
         """
-        if (type(location) == str):
-            return []
-        x, y = location[0], location[1]
-        neighbors = [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]
-        for neighbor in tuple(neighbors):
-            if neighbor[0] < 0 or neighbor[0] >= self.dimensions[1] or neighbor[1] < 0 or neighbor[1] >= \
-                    self.dimensions[0] or self.state['map'][neighbor[0]][neighbor[1]] == 'I':
-                neighbors.remove(neighbor)
-        return neighbors
+        return list(product(*self.legal_actions_by_ship(player).values()))
 
     def check_if_action_legal(self, action, player):
         """Checks if the given action is legal for the specified player.
@@ -49,51 +372,56 @@ class Simulator:
             - Returns False if any of the checks fail."""
         def _is_move_action_legal(move_action, player):
             pirate_name = move_action[1]
-            if pirate_name not in self.state['pirate_ships'].keys():
-                logging.error(f"Pirate {pirate_name} does not exist!")
+            if pirate_name not in game_state.ship_index:
+                logging.error("Pirate %s does not exist!", pirate_name)
                 return False
-            if player != self.state['pirate_ships'][pirate_name]['player']:
-                logging.error(f"Pirate {pirate_name} does not belong to player {player}!")
+            pirate = game_state.ship_index[pirate_name]
+            if player != game_state.ship_players[pirate]:
+                logging.error("Pirate %s does not belong to player %s!", pirate_name, player)
                 return False
-            l1 = self.state['pirate_ships'][pirate_name]['location']
+            l1 = game_state.ship_locations[pirate]
             l2 = move_action[2]
             if l2 not in self.neighbors(l1):
-                logging.error(f"Pirate {pirate_name} cannot move from {l1} to {l2}!")
+                logging.error("Pirate %s cannot move from %s to %s!", pirate_name, l1, l2)
                 return False
             return True
 
         def _is_collect_action_legal(collect_action, player):
             pirate_name = collect_action[1]
             treasure_name = collect_action[2]
-            if player != self.state['pirate_ships'][pirate_name]['player']:
+            pirate = game_state.ship_index[pirate_name]
+            if player != game_state.ship_players[pirate]:
                 return False
             # check adjacent position
-            l1 = self.state['treasures'][treasure_name]['location']
-            if self.state['pirate_ships'][pirate_name]['location'] not in self.neighbors(l1):
+            l1 = game_state.treasures[treasure_name][0]
+            if game_state.ship_locations[pirate] not in self.neighbors(l1):
                 return False
             # check ship capacity
-            if self.state['pirate_ships'][pirate_name]['capacity'] <= 0:
+            if game_state.ship_capacities[pirate] <= 0:
                 return False
             return True
 
         def _is_deposit_action_legal(deposit_action, player):
             pirate_name = deposit_action[1]
             treasure_name = deposit_action[2]
+            pirate = game_state.ship_index[pirate_name]
             # check same position
-            if player != self.state['pirate_ships'][pirate_name]['player']:
+            if player != game_state.ship_players[pirate]:
                 return False
-            if self.state["pirate_ships"][pirate_name]["location"] != self.base_location:
+            if game_state.ship_locations[pirate] != self.base_location:
                 return False
-            if self.state['treasures'][treasure_name]['location'] != pirate_name:
+            if game_state.treasures[treasure_name][0] != pirate_name:
                 return False
             return True
 
         def _is_plunder_action_legal(plunder_action, player):
             pirate_1_name = plunder_action[1]
             pirate_2_name = plunder_action[2]
-            if player != self.state["pirate_ships"][pirate_1_name]["player"]:
+            pirate_1 = game_state.ship_index[pirate_1_name]
+            pirate_2 = game_state.ship_index[pirate_2_name]
+            if player != game_state.ship_players[pirate_1]:
                 return False
-            if self.state["pirate_ships"][pirate_1_name]["location"] != self.state["pirate_ships"][pirate_2_name]["location"]:
+            if game_state.ship_locations[pirate_1] != game_state.ship_locations[pirate_2]:
                 return False
             return True
 
@@ -112,41 +440,42 @@ class Simulator:
 
             return False
 
-        players_pirates = [pirate for pirate in self.state['pirate_ships'].keys() if self.state['pirate_ships'][pirate]['player'] == player]
+        game_state = self.game_state
+        players_pirates = game_state.ships_of(player)
         
         if len(action) != len(players_pirates):
-            logging.error(f"You had given {len(action)} atomic commands, while you control {len(players_pirates)}!")
+            logging.error("You had given %d atomic commands, while you control %d!", len(action), len(players_pirates))
             return False
         for atomic_action in action:
             # trying to act with a pirate that is not yours
             if atomic_action[1] not in players_pirates:
-                logging.error(f"Pirate ship {atomic_action[1]} is not yours!")
+                logging.error("Pirate ship %s is not yours!", atomic_action[1])
                 return False
             # illegal sail action
             if atomic_action[0] == 'sail':
                 if not _is_move_action_legal(atomic_action, player):
-                    logging.error(f"Sail action {atomic_action} is illegal!")
+                    logging.error("Sail action %s is illegal!", atomic_action)
                     return False
             # illegal collect action
             elif atomic_action[0] == 'collect':
                 if not _is_collect_action_legal(atomic_action, player):
-                    logging.error(f"Collect action {atomic_action} is illegal!")
+                    logging.error("Collect action %s is illegal!", atomic_action)
                     return False
             # illegal deposit action
             elif atomic_action[0] == 'deposit':
                 if not _is_deposit_action_legal(atomic_action, player):
-                    logging.error(f"Deposit action {atomic_action} is illegal!")
+                    logging.error("Deposit action %s is illegal!", atomic_action)
                     return False
             # illegal plunder action
             elif atomic_action[0] == "plunder":
                 if not _is_plunder_action_legal(atomic_action, player):
-                    logging.error(f"Plunder action {atomic_action} is illegal!")
+                    logging.error("Plunder action %s is illegal!", atomic_action)
                     return False
             elif atomic_action[0] != 'wait':
                 return False
         # check mutex action
         if _is_action_mutex(action):
-            logging.error(f"Actions {action} are mutex!")
+            logging.error("Actions %s are mutex!", action)
             return False
         return True
 
@@ -159,68 +488,68 @@ class Simulator:
         """
         Checks collisions with marines, applies penalties. Does not move them
         """
-        marine_locations = []
-        treasures_to_remove = []
-        for marine_stats in self.state["marine_ships"].values():
-            index = marine_stats["index"]
-            marine_locations.append(marine_stats["path"][index])
-
-        for ship_name in self.state["pirate_ships"].keys():
-            if self.state["pirate_ships"][ship_name]["location"] in marine_locations:
-                self.state["pirate_ships"][ship_name]["capacity"] = 2
-                player = self.state["pirate_ships"][ship_name]["player"]
-                self.score[f"player {player}"] -= self.MARINE_COLLISION_PENALTY
-                for treasure_name in self.state["treasures"].keys():
-                    if self.state["treasures"][treasure_name]["location"] == ship_name:
-                        treasures_to_remove.append(treasure_name)
-        for treasures_r in treasures_to_remove:
-            del self.state["treasures"][treasures_r]
+        game_state = self.game_state
+        for marine_location in self.marines_at:
+            for ship in self.ships_at.get(marine_location, ()):
+                self._set_ship_capacity(ship, 2)
+                player_key = f"player {game_state.ship_players[ship]}"
+                self._set_score(player_key, self.score[player_key] - self.MARINE_COLLISION_PENALTY)
+                for treasures_r in self.treasures_at.get(game_state.ship_names[ship], ()):
+                    self._set_treasure(treasures_r, None)
 
     def move_marines(self):
         """
         Moves marines uniformly along their path.
         """
-        for marine in self.state['marine_ships']:
-            marine_stats = self.state["marine_ships"][marine]
-            index = marine_stats["index"]
-            if len(marine_stats["path"]) == 1:
+        game_state = self.game_state
+        tape = self.tape
+        if tape is not None:
+            move = self.tape_cursor[1]
+            self._set_tape_cursor(1, move + 1)
+        for marine, path in enumerate(game_state.marine_paths):
+            index = game_state.marine_indices[marine]
+            if len(path) == 1:
                 continue
             if index == 0:
-                marine_stats["index"] = random.choice([0, 1])
-            elif index == len(marine_stats["path"])-1:
-                marine_stats["index"] = random.choice([index, index-1])
+                choices = [0, 1]
+            elif index == len(path)-1:
+                choices = [index, index-1]
             else:
-                marine_stats["index"] = random.choice(
-                    [index-1, index, index+1])
+                choices = [index-1, index, index+1]
+            draw = tape.marine_draw(move, marine) if tape is not None else None
+            if draw is None:
+                self._set_marine_index(marine, self.rng.choice(choices))
+            else:
+                self._set_marine_index(marine, choices[int(draw * len(choices))])
 
     def _apply_atomic_action(self, atomic_action, player):
         """
         apply an atomic action to the state
         """
+        game_state = self.game_state
         pirate_name = atomic_action[1]
         if atomic_action[0] == 'sail':
-            self.state['pirate_ships'][pirate_name]['location'] = atomic_action[2]
+            self._set_ship_location(game_state.ship_index[pirate_name], atomic_action[2])
             return
         elif atomic_action[0] == 'collect':
             treasure_name = atomic_action[2]
-            self.state["pirate_ships"][pirate_name]["capacity"] -=1
-            self.state["treasures"][treasure_name]["location"] = pirate_name
+            pirate = game_state.ship_index[pirate_name]
+            self._set_ship_capacity(pirate, game_state.ship_capacities[pirate] - 1)
+            self._set_treasure(treasure_name, (pirate_name, game_state.treasures[treasure_name][1]))
             return
         elif atomic_action[0] == 'deposit':
             treasure_name = atomic_action[2]
-            self.state['pirate_ships'][pirate_name]['capacity'] += 1
-            self.score[f"player {player}"] += self.state['treasures'][treasure_name]['reward']
-            del self.state['treasures'][treasure_name]
+            pirate = game_state.ship_index[pirate_name]
+            player_key = f"player {player}"
+            self._set_ship_capacity(pirate, game_state.ship_capacities[pirate] + 1)
+            self._set_score(player_key, self.score[player_key] + game_state.treasures[treasure_name][1])
+            self._set_treasure(treasure_name, None)
             return
         elif atomic_action[0] == 'plunder':
             advers_pirate_name = atomic_action[2]
-            plundered_treasures = []
-            self.state["pirate_ships"][advers_pirate_name]["capacity"] = 2
-            for treasure_adv in self.state["treasures"].keys():
-                if self.state["treasures"][treasure_adv]["location"] == advers_pirate_name:
-                    plundered_treasures.append(treasure_adv)
-            for p_treas in plundered_treasures:
-                del self.state["treasures"][p_treas]
+            self._set_ship_capacity(game_state.ship_index[advers_pirate_name], 2)
+            for p_treas in self.treasures_at.get(advers_pirate_name, ()):
+                self._set_treasure(p_treas, None)
             return
         elif atomic_action[0] == 'wait':
             return
@@ -228,25 +557,40 @@ class Simulator:
             raise NotImplemented
 
     def add_treasure(self):
-        if len(self.state['treasures']) > 9:
+        """
+        A new treasure arrives with probability TREASURE_ARRIVAL_PROBABILITY, under a uniformly chosen unused name,
+        on a uniformly chosen island cell. The draws come from the tape when one is attached.
+        """
+        game_state = self.game_state
+        draws = None
+        if self.tape is not None:
+            # The tape advances on every call, so each act() always meets the same draws.
+            act = self.tape_cursor[0]
+            self._set_tape_cursor(0, act + 1)
+            draws = self.tape.treasure_draws(act)
+        if len(game_state.treasures) > 9:
+            return
+        if draws is None:
+            rng = self.rng
+            if rng.random() >= TREASURE_ARRIVAL_PROBABILITY:
+                return
+            draws = None, rng.random(), rng.random(), rng.randint(1, 9)
+        elif draws[0] >= TREASURE_ARRIVAL_PROBABILITY:
+            return
+        _, name_draw, cell_draw, reward = draws
+        free_names = [name for name in TREASURE_NAMES if name not in game_state.treasures]
+        if not free_names or not self.island_cells:
             return
-        if random.random() < TREASURE_ARRIVAL_PROBABILITY:
-            while True:
-                treasure_name = random.choice(TREASURE_NAMES)
-                if treasure_name not in self.state['treasures'].keys():
-                    break
-            while True:
-                treasure_location = (
-                random.randint(0, self.dimensions[0] - 1), random.randint(0, self.dimensions[1] - 1))
-                if self.state['map'][treasure_location[0]][treasure_location[1]] == 'I':
-                    break
-
-            reward = random.randint(1, 9)
-            self.state['treasures'][treasure_name] = {'location': treasure_location,
-                                                        'reward': reward}
-
-    def act(self, action, player):
-        if self.check_if_action_legal(action, player):
+        treasure_name = free_names[int(name_draw * len(free_names))]
+        treasure_location = self.island_cells[int(cell_draw * len(self.island_cells))]
+        self._set_treasure(treasure_name, (treasure_location, reward))
+
+    def act(self, action, player, trusted=False):
+        """
+        Applies the joint action of the player and the random arrival of treasures.
+        A trusted action (one generated by legal_actions() in the current state) is not validated again.
+        """
+        if trusted or self.check_if_action_legal(action, player):
             self.apply_action(action, player)
             self.add_treasure()
         else:
@@ -270,10 +614,24 @@ class Simulator:
             print("------------------")
 
     def set_state(self, state):
-        self.state = state
+        """ Replaces the state of the simulator. This also drops the undo journal and the event tape. """
+        if isinstance(state, GameState):
+            self.game_state = state
+        else:
+            self.game_state = GameState.from_dict(state)
+        self.dimensions = len(self.game_state.map), len(self.game_state.map[0])
+        self.base_location = self.game_state.base
+        self.adjacency = adjacency_table(self.game_state.map)
+        self.island_cells = island_cells(self.game_state.map)
+        self.journal = None
+        # A tape belongs to the game the simulator played, the new state starts without one.
+        self.tape = None
+        self.tape_cursor = [0, 0]
+        self.hash = zobrist_hash(self.game_state)
+        self._build_indexes()
 
     def get_state(self):
-        return deepcopy(self.state)
+        return self.game_state.to_dict()
 
     def get_score(self):
         return self.score
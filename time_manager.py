@@ -0,0 +1,104 @@
+"""
+Time management of the UCTAgent search.
+main.py allows every act() call ACTION_TIMEOUT seconds and takes PENALTY points for going over it,
+so a turn's search budget is that timeout minus a safety margin that grows with the cost of the slow iterations.
+Critical turns get the whole budget, other turns a share of it.
+Any search stops early once its decision can't change.
+"""
+
+from collections import deque
+from time import time
+
+
+class TimeManager:
+    """
+    Decides how long each search runs.
+    The iteration costs are measured while searching: their running mean estimates how many iterations are left
+    before the deadline, and a high percentile of the recent ones sizes the safety margin, since an iteration that
+    starts before the deadline has to end before the timeout. A single slow iteration (a GC pause, say) is outvoted,
+    and one from long ago is forgotten, so it doesn't shrink all the later budgets.
+    A turn always runs at least one iteration, so its root gets children even when the margin takes the whole timeout.
+    """
+    def __init__(self, action_timeout=5, base_margin=0.4, normal_share=0.7, check_every=32, margin_percentile=0.99,
+                 recent_iterations=1000):
+        self.action_timeout = action_timeout
+        self.base_margin = base_margin
+        self.normal_share = normal_share
+        self.check_every = check_every
+        self.margin_percentile = margin_percentile
+        self.mean_iteration_cost = 0.0
+        # The costs of the last recent_iterations iterations.
+        self.recent_costs = deque(maxlen=recent_iterations)
+        self.start_time = self.deadline = 0.0
+        self.early_stop = False
+        self.iterations = 0
+
+    def slow_iteration_cost(self):
+        """ The margin_percentile percentile of the recent iteration costs (0 before any iteration). """
+        if not self.recent_costs:
+            return 0.0
+        costs = sorted(self.recent_costs)
+        return costs[min(int(len(costs) * self.margin_percentile), len(costs) - 1)]
+
+    def safety_margin(self):
+        return self.base_margin + 2 * self.slow_iteration_cost()
+
+    def turn_budget(self, critical=False):
+        """ The seconds of search a turn gets, critical turns get the whole time left after the safety margin. """
+        available = max(self.action_timeout - self.safety_margin(), 0.0)
+        return available if critical else available * self.normal_share
+
+    def start_turn(self, start_time, critical=False, time_limit=None):
+        """
+        Starts the clock of a turn that began at start_time (so the time already spent in it is counted).
+        A fixed time_limit overrides the budget and disables the early stop.
+        """
+        self.start_time = start_time
+        self.early_stop = time_limit is None
+        self.deadline = start_time + (self.turn_budget(critical) if time_limit is None else time_limit)
+        self.iterations = 0
+
+    def remaining(self):
+        return self.deadline - time()
+
+    def record_iteration(self, cost):
+        self.iterations += 1
+        self.mean_iteration_cost += (cost - self.mean_iteration_cost) / min(self.iterations, 100)
+        self.recent_costs.append(cost)
+
+    def keep_searching(self, root=None, statistics=None):
+        """
+        Returns False once the next iteration may not end before the deadline, or (every check_every iterations,
+        given the root) once no root child can overtake the best one in the iterations that are left.
+        The first iteration of a turn always runs. statistics is passed on to decided().
+        """
+        if self.iterations == 0:
+            return True
+        remaining = self.remaining()
+        if remaining <= self.mean_iteration_cost:
+            return False
+        if root is not None and self.early_stop and self.iterations % self.check_every == 0:
+            return not self.decided(root, remaining / max(self.mean_iteration_cost, 1e-6), statistics)
+        return True
+
+    @staticmethod
+    def decided(root, remaining_iterations, statistics=None):
+        """
+        Returns True if the child with the best mean score stays the best whatever the results of the remaining
+        iterations: even if all of them go to another child and are won, that child's mean stays below the best mean
+        when all of them go to the best child and are lost.
+        statistics maps a child to its (visits, sum of scores), by default the child's own.
+        """
+        children = root.children
+        if len(children) == 1:
+            return True
+        if statistics is None:
+            statistics = lambda child: (child.visits, child.sum_score)
+        totals = [statistics(child) for child in children]
+        if not children or any(visits == 0 for visits, _ in totals):
+            return False
+        best = max(range(len(totals)), key=lambda index: totals[index][1] / totals[index][0])
+        best_visits, best_score = totals[best]
+        lowest_best_mean = best_score / (best_visits + remaining_iterations)
+        return all((sum_score + remaining_iterations) / (visits + remaining_iterations) < lowest_best_mean
+                   for index, (visits, sum_score) in enumerate(totals) if index != best)
@@ -0,0 +1,54 @@
+"""
+A transposition table for the UCT search.
+The same state is reached through different orders of the same moves, so the tree holds several nodes for it.
+The table shares the statistics of taking an action in a state between all those nodes.
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class TranspositionTable:
+    """
+    Statistics of (state, action) pairs, as [visits, sum of scores] lists, from the point of view of the player
+    taking the action.
+    A state is keyed by the simulator's Zobrist hash and the score, since the same position with another score
+    is another game.
+    The table holds at most max_megabytes of entries (by an estimated size per entry), and evicts the least
+    recently used entry when it is full.
+    """
+    # An estimate of the memory an entry takes: its key tuple (with the action tuple), the statistics list and
+    # the links of the OrderedDict.
+    ENTRY_BYTES = 512
+
+    def __init__(self, max_megabytes=64):
+        self.max_entries = max(int(max_megabytes * 2 ** 20 / self.ENTRY_BYTES), 1)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def state_key(simulator):
+        return simulator.hash, simulator.score['player 1'], simulator.score['player 2']
+
+    def get(self, key):
+        """ Returns the statistics of the key, or None if it is not in the table. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def entry(self, key):
+        """ Returns the statistics of the key, adding empty statistics (and evicting if needed) if it is missing. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            entry = self.entries[key] = [0, 0]
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return entry
+
+    def __len__(self):
+        return len(self.entries)
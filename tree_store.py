@@ -0,0 +1,150 @@
+"""
+An array-backed store for the UCT search tree.
+Instead of a UCTNode object per node (with its __dict__, children list and parent pointer), the nodes are indices
+into preallocated parallel arrays, and the children of a node are a contiguous block of indices.
+Joint actions are interned, so a node holds only the id of its action.
+"""
+
+from array import array
+
+
+class TreeStore:
+    """
+    The nodes of a search tree, in parallel arrays indexed by node:
+        - visits, sum_score: the statistics of the node, from the point of view of the player whose action led to it.
+        - parent: the index of the parent (-1 for the root).
+        - first_child, child_count: the block of the node's children (child_count 0 for a leaf).
+        - action: the id of the action that led to the node (-1 for the root), see action_of().
+        - player: the player to move in the node.
+    The arrays double when they are full. Adding children to a node that already has some moves its block to the end,
+    and the old block is left as garbage until compact() copies the live part of the tree into fresh arrays.
+    """
+    def __init__(self, capacity=1 << 14):
+        self.capacity = capacity
+        self.size = 0
+        # 'q' is a 64-bit integer on every platform ('l' is 32-bit on Windows).
+        self.visits = self._zeros('q', capacity)
+        self.sum_score = self._zeros('d', capacity)
+        self.parent = self._zeros('q', capacity)
+        self.first_child = self._zeros('q', capacity)
+        self.child_count = self._zeros('q', capacity)
+        self.action = self._zeros('q', capacity)
+        self.player = self._zeros('b', capacity)
+        self.actions = []
+        self.action_ids = {}
+
+    @staticmethod
+    def _zeros(typecode, count):
+        return array(typecode, bytes(array(typecode).itemsize * count))
+
+    def _arrays(self):
+        return self.visits, self.sum_score, self.parent, self.first_child, self.child_count, self.action, self.player
+
+    def _reserve(self, count):
+        """ Makes room for count more nodes, doubling the arrays as needed. """
+        if self.size + count <= self.capacity:
+            return
+        capacity = self.capacity
+        while self.size + count > capacity:
+            capacity *= 2
+        for values in self._arrays():
+            values.extend(self._zeros(values.typecode, capacity - self.capacity))
+        self.capacity = capacity
+
+    def _allocate(self, count):
+        """ Returns the index of a block of count new (zeroed) nodes. """
+        self._reserve(count)
+        first = self.size
+        self.size += count
+        return first
+
+    def action_id(self, action):
+        action_id = self.action_ids.get(action)
+        if action_id is None:
+            action_id = self.action_ids[action] = len(self.actions)
+            self.actions.append(action)
+        return action_id
+
+    def action_of(self, node):
+        return self.actions[self.action[node]]
+
+    def new_root(self, player):
+        """ Empties the store and returns the index of a new root, where the given player is to move. """
+        self.size = 0
+        self.actions = []
+        self.action_ids = {}
+        root = self._allocate(1)
+        self._init_node(root, -1, -1, player)
+        return root
+
+    def _init_node(self, node, parent, action_id, player):
+        self.visits[node] = 0
+        self.sum_score[node] = 0.0
+        self.parent[node] = parent
+        self.first_child[node] = 0
+        self.child_count[node] = 0
+        self.action[node] = action_id
+        self.player[node] = player
+
+    def children(self, node):
+        first = self.first_child[node]
+        return range(first, first + self.child_count[node])
+
+    def add_children(self, node, actions, player):
+        """ Adds a child per action (the player is the one to move in them) to the node. """
+        count = self.child_count[node]
+        if not actions:
+            return
+        first = self._allocate(count + len(actions))
+        if count:
+            # The node's existing children move to the new block, and their own children are repointed to them.
+            old_first = self.first_child[node]
+            for offset in range(count):
+                old, new = old_first + offset, first + offset
+                for values in self._arrays():
+                    values[new] = values[old]
+                for grandchild in self.children(new):
+                    self.parent[grandchild] = new
+        for offset, action in enumerate(actions):
+            self._init_node(first + count + offset, node, self.action_id(action), player)
+        self.first_child[node] = first
+        self.child_count[node] = count + len(actions)
+
+    def update(self, node, win):
+        self.visits[node] += 1
+        self.sum_score[node] += win
+
+    def compact(self, root):
+        """
+        Keeps only the subtree of the given node, copied breadth first into fresh arrays (so every block of children
+        stays contiguous and the garbage of moved blocks is dropped). Returns the new index of the node, which is 0.
+        """
+        old = TreeStore.__new__(TreeStore)
+        old.visits, old.sum_score, old.parent, old.first_child, old.child_count, old.action, old.player = \
+            self._arrays()
+        old_actions = self.actions
+        self.__init__(self.capacity)
+        new_root = self._allocate(1)
+        self._init_node(new_root, -1, -1, old.player[root])
+        self.visits[new_root] = old.visits[root]
+        self.sum_score[new_root] = old.sum_score[root]
+        queue = [(root, new_root)]
+        for old_node, new_node in queue:
+            count = old.child_count[old_node]
+            if not count:
+                continue
+            first = self._allocate(count)
+            self.first_child[new_node] = first
+            self.child_count[new_node] = count
+            old_first = old.first_child[old_node]
+            for offset in range(count):
+                old_child, new_child = old_first + offset, first + offset
+                self._init_node(new_child, new_node, self.action_id(old_actions[old.action[old_child]]),
+                                old.player[old_child])
+                self.visits[new_child] = old.visits[old_child]
+                self.sum_score[new_child] = old.sum_score[old_child]
+                queue.append((old_child, new_child))
+        return new_root
+
+    def __len__(self):
+        return self.size